@@ -1,15 +1,24 @@
 import enum as _enum
+import functools as _ft
 import tkinter as _tk
+import tkinter.filedialog as _fd
 import tkinter.messagebox as _msg
 import tkinter.ttk as _ttk
 
+import archive
+import dates
+import delivery
+import export
 import logo
+import querystats
 import util
+from analytics import REPORTS, Analytics
 from db_sqlite import Database
 from style import Button, Entry
-from tableview import TableView
+from tableview import PagedTableView, TableView
 from tabs import Tabs
 from window import Window
+from worker import Worker
 
 __all__ = ["Admin"]
 
@@ -20,10 +29,24 @@ class DeliveryActions(_enum.Enum):
     UPDATE = "Обновить"
 
 
+# delivery.ACTIONS by the labels shown in the delivery table
+_action_names = {
+    DeliveryActions.INSERT.value: "insert",
+    DeliveryActions.ADD.value: "add",
+    DeliveryActions.UPDATE.value: "update",
+}
+
+# errors listed after an import, the rest are only counted
+_errors_shown = 10
+
+
 class Admin(Window):
     def __init__(self):
         super().__init__("Панель администратора")
         self.db = Database()
+        self.worker = Worker(self)
+        self.worker.on_busy = self.on_busy
+        self.analytics = None
         self.goods_cols = [
             "Штрихкод",
             "Наименование",
@@ -31,9 +54,15 @@ class Admin(Window):
             "Количество",
             "Цена",
         ]
-        return
         self.create_widgets()
 
+    def destroy(self):
+        self.worker.stop()
+        super().destroy()
+
+    def on_busy(self, busy):
+        self.config(cursor="watch" if busy else "")
+
     def create_widgets(self):
         logo.get_label(self).pack()
         tabs = Tabs(self)
@@ -42,15 +71,22 @@ class Admin(Window):
                 self.create_goods: "Товары",
                 self.create_delivery: "Поставка",
                 self.create_sales: "Продажи",
+                self.create_reports: "Отчёты",
+                self.create_queries: "Запросы",
             }
         )
 
     def create_goods(self, master):
         frame = _ttk.Frame(master)
-        self.goods = TableView(frame, self.db, "goods", self.goods_cols)
+        self.goods = TableView(
+            frame, self.db, "goods", self.goods_cols, worker=self.worker
+        )
         self.goods.update_data()
         self.goods.pack(expand=True, fill="both", padx=20, pady=20)
         Button(frame, text="Обновить", command=self.goods.update_data).pack(pady=15)
+        Button(
+            frame, text="Экспорт", command=_ft.partial(self.export_table, "goods")
+        ).pack()
         return frame
 
     def create_delivery(self, master):
@@ -67,6 +103,7 @@ class Admin(Window):
         Button(subframe, text="Завершить поставку", command=self.make_delivery).pack(
             pady=40
         )
+        Button(subframe, text="Загрузить CSV", command=self.import_delivery).pack()
 
         return frame
 
@@ -104,9 +141,9 @@ class Admin(Window):
         return True
 
     def product_exists(self, barcode):
-        for row in self.goods.get_children():
-            if str(self.goods.item(row)["values"][0]) == barcode:
-                return True
+        # rows of the goods table are keyed by their id, the barcode
+        if self.goods.exists(str(int(barcode))):
+            return True
 
         for row in self.delivery.get_children():
             if str(self.delivery.item(row)["values"][0]) == barcode:
@@ -140,33 +177,72 @@ class Admin(Window):
         [e.delete(0, "end") for e in self.product_info]
 
     def make_delivery(self):
-        for row in self.delivery.get_children():
-            row = self.delivery.item(row)["values"]
-            if row[-1] == DeliveryActions.INSERT.value:
-                self.db.add_product(*row[:-1])
-            elif row[-1] == DeliveryActions.ADD.value:
-                self.db.change_by_amount(row[0], row[3])
-            else:
-                kwargs = dict(
-                    zip(["name", "manufacturer", "amount", "price"], row[1:-1])
-                )
-                self.db.update_product(row[0], **kwargs)
+        items = self.delivery.get_children()
+        rows = []
+        for i, row in enumerate(items, 1):
+            # Treeview turns numeric strings into numbers
+            values = [str(value) for value in self.delivery.item(row)["values"]]
+            record = dict(zip(delivery.COLUMNS, values[:3]))
+            record["barcode"] = record["barcode"].zfill(13)
+            record["amount"], record["sell_price"] = values[3:5]
+            record["action"] = _action_names[values[-1]]
+            rows.append((i, record))
+        if not rows:
+            return
+
+        self.worker.submit(
+            delivery.import_rows,
+            rows,
+            on_done=lambda result: self.on_delivered(result, items),
+        )
 
-        self.delivery.clear()
+    def import_delivery(self):
+        filename = _fd.askopenfilename(
+            parent=self, filetypes=[("CSV", "*.csv"), ("Все файлы", "*")]
+        )
+        if filename:
+            self.worker.submit(
+                delivery.import_csv, filename, on_done=self.on_delivered
+            )
+
+    def on_delivered(self, result, items=()):
+        count, errors = result
+        # rows with errors stay in the delivery table to be fixed
+        failed = {line for line, _ in errors}
+        done = [item for i, item in enumerate(items, 1) if i not in failed]
+        if done:
+            self.delivery.delete(*done)
         self.goods.update_data()
+        if not errors:
+            return _msg.showinfo("Поставка", "Загружено строк: %d" % count)
+
+        lines = ["Загружено строк: %d, с ошибками: %d" % (count, len(errors))]
+        lines += ["%d: %s" % error for error in errors[:_errors_shown]]
+        if len(errors) > _errors_shown:
+            lines.append("...")
+        util.show_error("\n".join(lines))
 
     def create_sales(self, master):
         frame = _ttk.Frame(master)
-        column_names = ["ID", "ID чека", "Штрихкод", "Количество", "Стоимость"]
+        column_names = ["ID", "ID чека", "Штрихкод", "Количество", "Дата продажи"]
         display_columns = [n for n in column_names if n != "ID"]
 
         frame.grid_columnconfigure(0, weight=1)
         frame.grid_columnconfigure(1, weight=2)
 
-        self.checks = TableView(frame, self.db, "checks", ["ID чека", "Сумма"])
+        self.checks = PagedTableView(
+            frame, self.db, "checks", ["ID чека", "Сумма"], worker=self.worker
+        )
         self.checks.grid(column=0, row=0, sticky="ew", padx=5, pady=5)
 
-        self.sales = TableView(frame, self.db, "sales", column_names)
+        self.sales = PagedTableView(
+            frame,
+            self.db,
+            "sales",
+            column_names,
+            worker=self.worker,
+            formats={4: dates.from_time},
+        )
         self.sales.config(displaycolumns=display_columns)
         self.sales.grid(column=1, row=0, sticky="ew", padx=5, pady=5)
 
@@ -179,6 +255,15 @@ class Admin(Window):
         Button(frame, text="Сбросить выручку", command=self.on_reset).grid(
             column=0, row=3, pady=10
         )
+        Button(frame, text="Архивировать", command=self.on_archive).grid(
+            column=0, row=4, pady=10
+        )
+        exports = _ttk.Frame(frame)
+        exports.grid(column=1, row=2, rowspan=2)
+        for table, text in [("checks", "Экспорт чеков"), ("sales", "Экспорт продаж")]:
+            Button(
+                exports, text=text, command=_ft.partial(self.export_table, table)
+            ).pack(pady=5)
 
         self.update_sales()
 
@@ -187,56 +272,188 @@ class Admin(Window):
     def update_sales(self):
         self.checks.update_data()
         self.sales.update_data()
+        self.worker.submit(Database.get_revenue, on_done=self.show_revenue)
 
-        result = 0
-        for row in self.checks.get_children():
-            result += self.checks.item(row)["values"][1]
-        self._check_sum.config(text="Выручка: %d" % result)
-
-    def find_sales(self, check_id):
-        result = []
-        for row in self.sales.get_children():
-            values = self.sales.item(row)["values"]
-            if values[1] == check_id:
-                result.append(row)
-        return result
+    def show_revenue(self, revenue):
+        self._check_sum.config(text="Выручка: %d" % revenue)
 
     def on_return(self):
         if not self.checks.selection() and not self.sales.selection():
             return util.show_error("Выберите хотя бы один чек или товар для возврата")
 
-        selected_sales = list(self.sales.selection())
+        # строки таблиц помечены ID записей
+        check_ids = [int(check) for check in self.checks.selection()]
+        sale_ids = {int(sale) for sale in self.sales.selection()}
+
+        def find_sales(db):
+            return sale_ids.union(db.get_checks_sales(check_ids))
 
-        for check in self.checks.selection():
-            check_id = self.checks.item(check)["values"][0]
-            selected_sales += self.find_sales(check_id)
-        selected_sales = set(selected_sales)
+        self.worker.submit(
+            find_sales, on_done=lambda ids: self.confirm_return(check_ids, ids)
+        )
 
+    def confirm_return(self, check_ids, sale_ids):
         if not _msg.askyesno(
             "Подтверждение",
-            "Вернуть чеков: %d, товаров: %d?"
-            % (len(self.checks.selection()), len(selected_sales)),
+            "Вернуть чеков: %d, товаров: %d?" % (len(check_ids), len(sale_ids)),
         ):
             return
 
-        for sale in selected_sales:
-            # ID записи в первом столбце (скрытом)
-            values = self.sales.item(sale)["values"]
-            self.db.return_sale(values[0])
+        def do_return(db):
+            with db.transaction():
+                # sales of the returned checks are gone by then
+                db.return_checks(check_ids)
+                db.return_sales(sale_ids)
 
-        for check in self.checks.selection():
-            values = self.checks.item(check)["values"]
-            self.db.return_check(values[0])
+        self.worker.submit(do_return, on_done=lambda _: self.on_returned())
 
+    def on_returned(self):
         self.update_sales()
         self.goods.update_data()
 
+    def on_archive(self):
+        if not _msg.askyesno(
+            "Подтверждение",
+            "Перенести в архив чеки старше %d мес.?" % archive._keep_months,
+        ):
+            return
+        self.worker.submit(archive.archive_old, on_done=self.on_archived)
+
+    def on_archived(self, moved):
+        _msg.showinfo("Архив", "Перенесено чеков: %d, товаров: %d" % moved)
+        self.update_sales()
+
+    def export_table(self, table):
+        filename = _fd.asksaveasfilename(
+            parent=self,
+            initialfile=table + ".csv",
+            filetypes=[
+                ("CSV", "*.csv"),
+                ("JSON Lines", "*.jsonl"),
+                ("CSV, gzip", "*.csv.gz"),
+                ("JSON Lines, gzip", "*.jsonl.gz"),
+            ],
+        )
+        if filename:
+            self.worker.submit(
+                export.export_file,
+                table,
+                filename,
+                on_done=lambda count: _msg.showinfo(
+                    "Экспорт", "Выгружено строк: %d" % count
+                ),
+            )
+
+    def create_reports(self, master):
+        frame = _ttk.Frame(master)
+
+        buttons = _ttk.Frame(frame)
+        buttons.pack(pady=10)
+        for title, columns, method in REPORTS:
+            Button(
+                buttons,
+                text=title,
+                command=_ft.partial(self.show_report, columns, method),
+            ).pack(side="left", padx=5)
+
+        self._report_frame = _ttk.Frame(frame)
+        self._report_frame.pack(expand=True, fill="both")
+        self.report = None
+        return frame
+
+    def run_report(self, db, method):
+        # runs on the worker, so the cache lives with the worker's connection
+        if self.analytics is None:
+            self.analytics = Analytics(db)
+        return getattr(self.analytics, method)()
+
+    def show_report(self, columns, method):
+        self.worker.submit(
+            self.run_report,
+            method,
+            on_done=lambda rows: self.fill_report(columns, rows),
+        )
+
+    def fill_report(self, columns, rows):
+        if self.report is not None:
+            self.report.destroy()
+        self.report = TableView(self._report_frame, columns=columns)
+        for row in rows:
+            self.report.insert("", "end", values=row)
+        self.report.pack(expand=True, fill="both", padx=20, pady=20)
+
+    def create_queries(self, master):
+        frame = _ttk.Frame(master)
+
+        buttons = _ttk.Frame(frame)
+        buttons.pack(pady=10)
+        self._collect_stats = _tk.BooleanVar(self, querystats.current() is not None)
+        _ttk.Checkbutton(
+            buttons,
+            text="Собирать статистику",
+            variable=self._collect_stats,
+            command=self.toggle_stats,
+        ).pack(side="left", padx=5)
+        for text, command in [
+            ("Обновить", self.show_stats),
+            ("Сбросить", self.reset_stats),
+            ("Сохранить JSON", self.dump_stats),
+        ]:
+            Button(buttons, text=text, command=command).pack(side="left", padx=5)
+
+        self.statements = TableView(
+            frame, columns=["Запрос", "Вызовов", "Всего, мс", "Макс, мс", "Строк"]
+        )
+        self.statements.column("Запрос", anchor="w", width=400)
+        self.statements.pack(expand=True, fill="both", padx=20, pady=5)
+        _ttk.Label(frame, text="Медленные запросы").pack()
+        self.slow_log = TableView(frame, columns=["Время", "мс", "Запрос", "План"])
+        self.slow_log.column("Запрос", anchor="w", width=300)
+        self.slow_log.column("План", anchor="w", width=300)
+        self.slow_log.pack(expand=True, fill="both", padx=20, pady=5)
+        self.show_stats()
+        return frame
+
+    def toggle_stats(self):
+        if self._collect_stats.get():
+            querystats.enable()
+        else:
+            querystats.disable()
+        self.show_stats()
+
+    def show_stats(self):
+        self.statements.clear()
+        self.slow_log.clear()
+        stats = querystats.current()
+        if stats is None:
+            return
+        for sql, count, total, longest, rows in stats.statements():
+            total, longest = "%.1f" % (total * 1000), "%.1f" % (longest * 1000)
+            self.statements.insert("", "end", values=[sql, count, total, longest, rows])
+        for time, seconds, sql, _, plan in reversed(stats.slow_log()):
+            seconds, plan = "%.1f" % (seconds * 1000), "; ".join(plan or [])
+            self.slow_log.insert("", "end", values=[time, seconds, sql, plan])
+
+    def reset_stats(self):
+        if querystats.current() is not None:
+            querystats.current().reset()
+        self.show_stats()
+
+    def dump_stats(self):
+        stats = querystats.current()
+        if stats is None:
+            return util.show_error("Статистика запросов не собирается")
+        filename = _fd.asksaveasfilename(
+            parent=self, initialfile="queries.json", filetypes=[("JSON", "*.json")]
+        )
+        if filename:
+            stats.dump(filename)
+
     def on_reset(self):
         if not _msg.askyesno("Подтверждение", "Сбросить всю выручку?"):
             return
 
-        self.db.reset_sales()
-        self.update_sales()
+        self.worker.submit(Database.reset_sales, on_done=lambda _: self.update_sales())
 
 
 if __name__ == "__main__":
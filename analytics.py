@@ -0,0 +1,122 @@
+import functools as _ft
+
+import dates as _dates
+
+__all__ = ["Analytics", "REPORTS"]
+
+# days are day numbers, see dates; a None bound leaves that side open
+_day_filter = "day >= COALESCE(?1, 0) AND day <= COALESCE(?2, 1000000000)"
+
+_top_sellers = """
+SELECT rank() OVER (ORDER BY SUM(s.amount) DESC), s.product_id, g.name,
+    SUM(s.amount), SUM(s.revenue)
+FROM daily_sales_summary AS s
+LEFT JOIN goods AS g ON g.id = s.product_id
+WHERE %s
+GROUP BY s.product_id HAVING SUM(s.amount) > 0
+ORDER BY 1 LIMIT ?3
+""" % _day_filter
+
+_daily_throughput = """
+SELECT date(day * 86400, 'unixepoch'), checks, revenue,
+    CAST(AVG(revenue) OVER (ORDER BY day ROWS 6 PRECEDING) AS INTEGER),
+    SUM(revenue) OVER (ORDER BY day)
+FROM daily_check_summary
+WHERE %s
+ORDER BY day
+""" % _day_filter
+
+_hourly_throughput = """
+SELECT hour, SUM(lines), SUM(amount), SUM(revenue)
+FROM hourly_sales_summary
+WHERE %s
+GROUP BY hour
+ORDER BY hour
+""" % _day_filter
+
+_gross_margin = """
+SELECT s.product_id, g.name, SUM(s.amount), SUM(s.revenue),
+    SUM(s.revenue) - SUM(s.amount) * g.purchase_price AS margin,
+    ROUND(100.0 * (SUM(s.revenue) - SUM(s.amount) * g.purchase_price)
+        / NULLIF(SUM(s.revenue), 0), 1)
+FROM daily_sales_summary AS s
+JOIN goods AS g ON g.id = s.product_id
+WHERE %s
+GROUP BY s.product_id HAVING SUM(s.amount) > 0
+ORDER BY margin DESC
+""" % _day_filter
+
+_bonus_liability = """
+SELECT COUNT(*), COALESCE(SUM(bonuses), 0), COALESCE(SUM(bonuses), 0) * 10
+FROM clients WHERE bonuses > 0
+"""
+
+# title, column names and Analytics method of every report
+REPORTS = [
+    (
+        "Лидеры продаж",
+        ["Место", "ID товара", "Наименование", "Количество", "Выручка"],
+        "top_sellers",
+    ),
+    (
+        "По дням",
+        ["День", "Чеков", "Выручка", "Среднее за 7 дней", "Нарастающий итог"],
+        "daily_throughput",
+    ),
+    ("По часам", ["Час", "Позиций", "Товаров", "Выручка"], "hourly_throughput"),
+    (
+        "Маржа",
+        ["ID товара", "Наименование", "Количество", "Выручка", "Маржа", "Маржа, %"],
+        "gross_margin",
+    ),
+    ("Бонусы", ["Клиентов", "Бонусов", "Рублей"], "bonus_liability"),
+]
+
+
+class Analytics:
+    """sales reports over Database; results are cached until the data changes.
+    Product reports read the trigger-maintained daily summaries, revenue
+    there is at list prices, margins use the current purchase price"""
+
+    def __init__(self, db, cache_size=32):
+        self.db = db
+        self._run = _ft.lru_cache(maxsize=cache_size)(self._query)
+
+    def _version(self):
+        # data_version moves on commits from other connections,
+        # total_changes on every write made through this one
+        data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, self.db._connection.total_changes
+
+    def _query(self, query, args, version):
+        return self.db.execute(query, args).fetchall()
+
+    def query(self, query, *args):
+        return self._run(query, args, self._version())
+
+    def _days(self, query, start, end, *args):
+        """query over the days between start and end,
+        YYYY-MM-DD strings or None"""
+        start = None if start is None else _dates.to_day(start)
+        end = None if end is None else _dates.to_day(end)
+        return self.query(query, start, end, *args)
+
+    def clear_cache(self):
+        self._run.cache_clear()
+
+    def top_sellers(self, start=None, end=None, limit=10):
+        return self._days(_top_sellers, start, end, limit)
+
+    def daily_throughput(self, start=None, end=None):
+        return self._days(_daily_throughput, start, end)
+
+    def hourly_throughput(self, start=None, end=None):
+        """hours are in UTC; sales recorded before sale times were kept
+        are counted in hour 0"""
+        return self._days(_hourly_throughput, start, end)
+
+    def gross_margin(self, start=None, end=None):
+        return self._days(_gross_margin, start, end)
+
+    def bonus_liability(self):
+        return self.query(_bonus_liability)
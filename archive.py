@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""archiving of closed months: checks and their sales move out of the live
+database into one SQLite file per year next to it, coffee-archive-2024.sqlite3
+and so on, a batch at a time so that tills are never locked out for long.
+
+The daily and hourly summaries keep covering archived days, so reports and
+revenue stay whole; rows themselves are read through the all_checks and
+all_sales views that Archive.attach_all() sets up over the live database and
+every archive.
+Run as `python archive.py [--before YYYY-MM] [--database FILE] [--list]`"""
+import argparse as _argparse
+import datetime as _dt
+import glob as _glob
+import json as _json
+import os.path as _path
+import re as _re
+import time as _time
+
+import dates as _dates
+
+__all__ = ["Archive", "archive_old"]
+
+# months kept live besides the current one
+_keep_months = 3
+# checks moved per transaction and seconds of rest between transactions
+_batch_size = 200
+_pause = 0.02
+
+_name_format = "%s-archive-%d.sqlite3"
+_schema_format = "archive_%d"
+
+# user_version of archive files: 1 has integer dates like the live tables
+_archive_version = 1
+
+_archive_script = """
+CREATE TABLE IF NOT EXISTS {0}.checks (
+    id INTEGER PRIMARY KEY,
+    sum INTEGER NOT NULL,
+    bonuses INTEGER NOT NULL,
+    client_id INTEGER,
+    sell_date INTEGER NOT NULL
+) STRICT;
+
+CREATE TABLE IF NOT EXISTS {0}.sales (
+    id INTEGER PRIMARY KEY,
+    check_id INTEGER,
+    product_id INTEGER,
+    amount INTEGER NOT NULL,
+    sell_date INTEGER NOT NULL,
+    price INTEGER NOT NULL
+) STRICT;
+
+CREATE INDEX IF NOT EXISTS {0}.sales_check_id ON sales(check_id);
+CREATE INDEX IF NOT EXISTS {0}.checks_sell_date ON checks(sell_date);
+"""
+
+# archives written while dates were YYYY-MM-DD text
+_text_dates = """
+ALTER TABLE {0}.checks RENAME TO checks_text;
+ALTER TABLE {0}.sales RENAME TO sales_text;
+DROP INDEX {0}.sales_check_id;
+DROP INDEX {0}.checks_sell_date;
+%s
+INSERT INTO {0}.checks SELECT id, sum, bonuses, client_id,
+    COALESCE(CAST(strftime('%%s', sell_date) AS INTEGER), 0)
+FROM {0}.checks_text;
+INSERT INTO {0}.sales SELECT id, check_id, product_id, amount,
+    COALESCE(CAST(strftime('%%s', sell_date) AS INTEGER), 0), price
+FROM {0}.sales_text;
+DROP TABLE {0}.checks_text;
+DROP TABLE {0}.sales_text;
+""" % _archive_script
+
+_columns = {
+    "checks": "id, sum, bonuses, client_id, sell_date",
+    "sales": "id, check_id, product_id, amount, sell_date, price",
+}
+
+# summaries kept as they are while archived rows are deleted,
+# restored for the days of each batch
+_summaries = ["daily_sales_summary", "daily_check_summary", "hourly_sales_summary"]
+
+_ids = "IN (SELECT value FROM json_each(?))"
+
+_select_batch = """
+SELECT id FROM main.checks
+WHERE sell_date >= ? AND sell_date < ? AND id > ?
+ORDER BY id LIMIT ?
+"""
+
+# checks.id is AUTOINCREMENT, so ids are not issued again; archives made
+# before it still need the sequence raised past their ids
+_archived_ids = """
+SELECT MAX(id) FROM {0}.checks
+WHERE id > IFNULL((SELECT seq FROM main.sqlite_sequence WHERE name = 'checks'), 0)
+"""
+
+# checks whose archived copy is still current: a till could return
+# a sale between the copy and the delete
+_verify_batch = """
+SELECT c.id FROM main.checks AS c JOIN {0}.checks AS a ON a.id = c.id
+WHERE c.id %s AND c.sum = a.sum AND c.bonuses = a.bonuses
+    AND (SELECT COUNT(*) FROM main.sales WHERE check_id = c.id)
+        = (SELECT COUNT(*) FROM {0}.sales WHERE check_id = c.id)
+""" % _ids
+
+_batch_days = """
+SELECT sell_date / 86400 FROM main.checks
+WHERE id IN (SELECT value FROM json_each(?1))
+UNION SELECT sell_date / 86400 FROM main.sales
+WHERE check_id IN (SELECT value FROM json_each(?1))
+"""
+
+
+def _month_start(month):
+    return _dt.date(*map(int, month.split("-")), 1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + _dt.timedelta(days=4)).replace(day=1)
+
+
+def _months_ago(day, count):
+    months = day.year * 12 + day.month - 1 - count
+    return _dt.date(months // 12, months % 12 + 1, 1)
+
+
+class Archive:
+    """the archives of db, a Database on a file; they are created in
+    directory, the one of the database by default"""
+
+    def __init__(self, db, directory=None):
+        self.db = db
+        filename = next(
+            row[2] for row in db.execute("PRAGMA database_list") if row[1] == "main"
+        )
+        if not filename and directory is None:
+            raise ValueError("an in-memory database needs an archive directory")
+        self.directory = directory or _path.dirname(filename)
+        self.prefix = _path.splitext(_path.basename(filename or "coffee"))[0]
+        self.longest = 0.0
+
+    def filename(self, year):
+        return _path.join(self.directory, _name_format % (self.prefix, year))
+
+    def years(self):
+        """years with an archive file, oldest first"""
+        pattern = _path.join(self.directory, "%s-archive-*.sqlite3" % self.prefix)
+        years = []
+        for filename in _glob.glob(pattern):
+            match = _re.search(r"-(\d+)\.sqlite3$", filename)
+            if match:
+                years.append(int(match.group(1)))
+        return sorted(years)
+
+    def _attached(self):
+        return {row[1] for row in self.db.execute("PRAGMA database_list")}
+
+    def attach(self, year):
+        """attach the archive of year, creating it if needed;
+        returns its schema name"""
+        schema = _schema_format % year
+        if schema not in self._attached():
+            # ATTACH is not allowed inside a transaction
+            self.db.save()
+            self.db.execute(
+                "ATTACH DATABASE ? AS %s" % schema, (self.filename(year),)
+            )
+            self._upgrade(schema)
+            self._reserve(schema)
+        return schema
+
+    def _upgrade(self, schema):
+        """create the tables of a new archive or bring an old one up to date"""
+        db = self.db
+        if db.execute("PRAGMA %s.user_version" % schema).fetchone()[0]:
+            return
+        old = db.execute(
+            "SELECT COUNT(*) FROM %s.sqlite_master WHERE name = 'checks'" % schema
+        ).fetchone()[0]
+        script = _text_dates if old else _archive_script
+        db._connection.executescript(
+            "BEGIN;\n%s\nPRAGMA %s.user_version = %d;\nCOMMIT;"
+            % (script.format(schema), schema, _archive_version)
+        )
+
+    def _reserve(self, schema):
+        """keep new checks from taking the ids archived in schema"""
+        last = self.db.execute(_archived_ids.format(schema)).fetchone()[0]
+        if last is None:
+            return
+        db = self.db
+        with db.transaction():
+            db.execute(
+                "UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'checks'",
+                (last,),
+            )
+            if not db.execute("SELECT changes()").fetchone()[0]:
+                db.execute(
+                    "INSERT INTO main.sqlite_sequence VALUES ('checks', ?)", (last,)
+                )
+
+    def attach_all(self):
+        """attach every archive and (re)create the temporary views
+        all_checks and all_sales over them and the live tables"""
+        schemas = ["main"] + [self.attach(year) for year in self.years()]
+        for table, columns in _columns.items():
+            self.db.execute("DROP VIEW IF EXISTS temp.all_%s" % table)
+            self.db.execute(
+                "CREATE TEMP VIEW all_%s AS %s"
+                % (
+                    table,
+                    " UNION ALL ".join(
+                        "SELECT %s FROM %s.%s" % (columns, schema, table)
+                        for schema in schemas
+                    ),
+                )
+            )
+        return schemas[1:]
+
+    def _copy(self, schema, ids):
+        # a transaction of its own that writes to the archive only;
+        # the archive mirrors the live rows of the batch afterwards
+        db = self.db
+        db.execute("DELETE FROM %s.sales WHERE check_id %s" % (schema, _ids), ids)
+        for table, column in [("checks", "id"), ("sales", "check_id")]:
+            db.execute(
+                "INSERT OR REPLACE INTO %s.%s SELECT %s FROM main.%s WHERE %s %s"
+                % (schema, table, _columns[table], table, column, _ids),
+                ids,
+            )
+        db.save()
+
+    def _delete(self, schema, ids):
+        """delete the checks of ids whose archived copy is current,
+        leaving the summaries of their days as they were"""
+        db = self.db
+        start = _time.perf_counter()
+        with db.transaction():
+            verified = [
+                row[0] for row in db.execute(_verify_batch.format(schema), ids)
+            ]
+            if not verified:
+                return 0, 0
+            ids = (_json.dumps(verified),)
+            days = (_json.dumps([row[0] for row in db.execute(_batch_days, ids)]),)
+            for table in _summaries:
+                db.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS kept_%s AS "
+                    "SELECT * FROM main.%s WHERE 0" % (table, table)
+                )
+                db.execute("DELETE FROM temp.kept_%s" % table)
+                db.execute(
+                    "INSERT INTO temp.kept_%s SELECT * FROM main.%s WHERE day %s"
+                    % (table, table, _ids),
+                    days,
+                )
+            db.execute("DELETE FROM main.sales WHERE check_id %s" % _ids, ids)
+            sales = db.execute("SELECT changes()").fetchone()[0]
+            db.execute("DELETE FROM main.checks WHERE id %s" % _ids, ids)
+            for table in _summaries:
+                db.execute(
+                    "INSERT OR REPLACE INTO main.%s SELECT * FROM temp.kept_%s"
+                    % (table, table)
+                )
+        self.longest = max(self.longest, _time.perf_counter() - start)
+        return len(verified), sales
+
+    def archive_month(self, month, batch=_batch_size, pause=_pause):
+        """move the checks of month, a YYYY-MM string, with their sales;
+        safe to interrupt and to run again.
+        Returns the numbers of checks and sales moved"""
+        start = _month_start(month)
+        end = _next_month(start)
+        schema = self.attach(start.year)
+        bounds = [_dates.day_start(_dates.day_of(day)) for day in (start, end)]
+        checks = sales = 0
+        last = 0
+        while True:
+            ids = [
+                row[0]
+                for row in self.db.execute(_select_batch, (*bounds, last, batch))
+            ]
+            self.db.save()
+            if not ids:
+                return checks, sales
+            last = ids[-1]
+            ids = (_json.dumps(ids),)
+            self._copy(schema, ids)
+            moved = self._delete(schema, ids)
+            checks += moved[0]
+            sales += moved[1]
+            _time.sleep(pause)
+
+    def archive_before(self, month, batch=_batch_size, pause=_pause):
+        """archive every month before month, a YYYY-MM string"""
+        end = _month_start(month)
+        first = self.db.execute("SELECT MIN(sell_date) FROM checks").fetchone()[0]
+        self.db.save()
+        checks = sales = 0
+        if first is None:
+            return checks, sales
+        day = _dates.date_of(first // 86400).replace(day=1)
+        while day < end:
+            moved = self.archive_month(day.strftime("%Y-%m"), batch, pause)
+            checks += moved[0]
+            sales += moved[1]
+            day = _next_month(day)
+        return checks, sales
+
+
+def archive_old(db, keep=_keep_months):
+    """archive the months that closed more than keep months ago;
+    returns the numbers of checks and sales moved"""
+    before = _months_ago(_dates.date_of(_dates.today()), keep)
+    return Archive(db).archive_before(before.strftime("%Y-%m"))
+
+
+def main(args=None):
+    from db_sqlite import Database
+
+    parser = _argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument(
+        "--before",
+        help="first month kept live, YYYY-MM; by default the one %d months ago"
+        % _keep_months,
+    )
+    parser.add_argument("--database")
+    parser.add_argument("--directory", help="where archives go")
+    parser.add_argument("--batch", type=int, default=_batch_size)
+    parser.add_argument("--pause", type=float, default=_pause)
+    parser.add_argument("--list", action="store_true", help="list archives")
+    args = parser.parse_args(args)
+
+    db = Database(*[args.database] if args.database else [])
+    archive = Archive(db, args.directory)
+    if args.list:
+        archive.attach_all()
+        for year in archive.years():
+            schema = _schema_format % year
+            checks, sales = (
+                db.execute("SELECT COUNT(*) FROM %s.%s" % (schema, table)).fetchone()[0]
+                for table in ["checks", "sales"]
+            )
+            print("%s: %d checks, %d sales" % (archive.filename(year), checks, sales))
+        return
+
+    today = _dates.date_of(_dates.today())
+    before = args.before or _months_ago(today, _keep_months).strftime("%Y-%m")
+    start = _time.perf_counter()
+    checks, sales = archive.archive_before(before, args.batch, args.pause)
+    print(
+        "archived %d checks, %d sales before %s in %.1f s, "
+        "longest lock %.1f ms"
+        % (
+            checks,
+            sales,
+            before,
+            _time.perf_counter() - start,
+            archive.longest * 1000,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+"""headless benchmarks for the database layer,
+run as `python bench.py [plans] [checkout] [terminals] [index] [search] [check]
+[import] [export] [returns] [rows] [group]` or
+`python bench.py suite [--tiers 1k,100k,1m] [--output FILE]
+[--baseline FILE] [--threshold 0.5] [--save-baseline]`"""
+import argparse as _argparse
+import collections as _collections
+import csv as _csv
+import json as _json
+import multiprocessing as _mp
+import os.path as _path
+import random as _rnd
+import sqlite3 as _sql
+import tempfile as _tmp
+import threading as _threading
+import time as _time
+import tracemalloc as _tracemalloc
+
+import dates
+import delivery
+import export
+import groupcommit
+from check import Check
+from db_sqlite import Database
+from goods_index import GoodsIndex
+from repository import STATEMENTS, Repository, Sale
+
+_goods_count = 1000
+_checks = 500
+_lines_per_check = 8
+_terminals = [1, 2, 4, 8]
+_terminal_checks = 200
+_catalog_size = 50000
+_lookups = 1000
+_delivery_lines = 100000
+_export_sales = [100000, 400000]
+_shift_sales = 100000
+_shift_checks = 2000
+_row_sales = 100000
+_group_checks = 2000
+_group_tills = 8
+# milliseconds between group commits
+_group_intervals = [50, 5]
+_use_by = dates.to_day("2099-01-01")
+_sell_date = dates.day_start(dates.to_day("2020-01-01"))
+
+# sales in the database of each tier of the suite
+_tiers = {"1k": 1000, "100k": 100000, "1m": 1000000}
+_suite_calls = 200
+_suite_repeats = 5
+# tiers a slowdown fails the suite for; calls on the 1k tier take
+# microseconds and vary too much between runs, so it is only reported
+_gated_tiers = ["100k", "1m"]
+# a gated tier slower than the baseline is run this many times more,
+# keeping the best time of each operation, before the slowdown counts
+_confirm_runs = 2
+_baseline = _path.join(_path.dirname(_path.abspath(__file__)), "bench_baseline.json")
+_threshold = 0.5
+
+
+def fill_goods(db, count):
+    db.execute("DELETE FROM sales")
+    db.execute("DELETE FROM checks")
+    db.execute("DELETE FROM goods")
+    db._cur.executemany(
+        "INSERT INTO goods VALUES (?, ?, 'bench', ?, ?, ?, 0, ?, 1)",
+        (
+            (
+                i,
+                "product %d" % i,
+                10**9,
+                _rnd.randint(50, 500),
+                _use_by,
+                _rnd.randint(0, 2),
+            )
+            for i in range(1, count + 1)
+        ),
+    )
+    db.save()
+
+
+def random_checks(goods_count, checks, lines_per_check):
+    return [
+        [
+            (_rnd.randint(1, goods_count), _rnd.randint(1, 3))
+            for _ in range(lines_per_check)
+        ]
+        for _ in range(checks)
+    ]
+
+
+def sell_per_line(db, checks):
+    for lines in checks:
+        check_id = db.get_new_check_id()
+        db.add_check(check_id, 0, 0, None)
+        for product_id, amount in lines:
+            db.sell_product(check_id, product_id, amount)
+        db.save()
+
+
+def sell_check(db, checks):
+    for lines in checks:
+        db.sell_check(None, lines)
+
+
+_hot_queries = [
+    ("SELECT id, bonuses FROM clients WHERE bonus_code = ?", ("000000",)),
+    ("SELECT id FROM clients WHERE phone = ?", ("",)),
+    ("DELETE FROM sales WHERE check_id = ?", (0,)),
+    (
+        "SELECT * FROM sales WHERE product_id = ? AND sell_date >= ?",
+        (0, 0),
+    ),
+    ("SELECT * FROM sales WHERE sell_date BETWEEN ? AND ?", (0, 0)),
+]
+
+
+def full_scans(db):
+    """return the hot queries whose plan falls back to a full table scan"""
+    result = []
+    for query, args in _hot_queries:
+        plan = db.execute("EXPLAIN QUERY PLAN " + query, args).fetchall()
+        if any(row[-1].startswith("SCAN ") for row in plan):
+            result.append(query)
+    return result
+
+
+def check_plans(db):
+    scans = full_scans(db)
+    for query in scans:
+        print("full scan:", query)
+    if scans:
+        raise SystemExit(1)
+    print("query plans ok")
+
+
+def _timed(func, *args):
+    start = _time.perf_counter()
+    func(*args)
+    return _time.perf_counter() - start
+
+
+def run_checkout(db, _):
+    checks = random_checks(_goods_count, _checks, _lines_per_check)
+    lines = _checks * _lines_per_check
+    for name, func in [("per-line", sell_per_line), ("sell_check", sell_check)]:
+        fill_goods(db, _goods_count)
+        func(db, checks[:10])  # warm up
+        elapsed = _timed(func, db, checks)
+        print("%-12s %10.0f lines/s" % (name, lines / elapsed))
+
+
+def _terminal(filename, barrier, checks):
+    db = Database(filename)
+    barrier.wait()
+    sell_check(db, checks)
+    db.close()
+
+
+def run_terminals(db, filename):
+    """sell from several processes at once; every check must get its own id"""
+    ctx = _mp.get_context("spawn")
+    fill_goods(db, _goods_count)
+    for count in _terminals:
+        barrier = ctx.Barrier(count + 1)
+        processes = [
+            ctx.Process(
+                target=_terminal,
+                args=(
+                    filename,
+                    barrier,
+                    random_checks(_goods_count, _terminal_checks, _lines_per_check),
+                ),
+            )
+            for _ in range(count)
+        ]
+        before = db.execute("SELECT COUNT(*) FROM checks").fetchone()[0]
+        for p in processes:
+            p.start()
+        barrier.wait()
+        start = _time.perf_counter()
+        for p in processes:
+            p.join()
+        elapsed = _time.perf_counter() - start
+
+        sold = db.execute("SELECT COUNT(*) FROM checks").fetchone()[0] - before
+        failed = sum(p.exitcode != 0 for p in processes)
+        print(
+            "%2d terminals %8.0f checks/s, %d failed, %d of %d checks sold"
+            % (count, sold / elapsed, failed, sold, count * _terminal_checks)
+        )
+        if failed or sold != count * _terminal_checks:
+            raise SystemExit(1)
+
+
+def _find_row(rows, name):
+    # what Cashier.find_row did, minus the Tk round trip per row
+    for row in rows:
+        if name == row[1]:
+            return row
+    return None
+
+
+def run_index(db, _):
+    fill_goods(db, _catalog_size)
+    rows = db.get_table("goods")
+    names = [rows[_rnd.randrange(len(rows))][1] for _ in range(_lookups)]
+
+    index = GoodsIndex(db)
+    print("index build  %10.3f s" % _timed(index.update))
+    for name, func in [
+        ("linear scan", lambda: [_find_row(rows, n) for n in names]),
+        ("index", lambda: [index.find(n) for n in names]),
+    ]:
+        elapsed = _timed(func)
+        print("%-12s %10.0f lookups/s" % (name, _lookups / elapsed))
+
+
+def _filter_rows(rows, text, max_price):
+    # what Cashier.on_search did, minus the Tk round trips
+    text = text.lower()
+    return [r[0] for r in rows if text in r[1].lower() and r[4] < max_price]
+
+
+def run_search(db, _):
+    fill_goods(db, _catalog_size)
+    rows = db.get_table("goods")
+    queries = ["product %d" % _rnd.randrange(_catalog_size) for _ in range(100)]
+    for name, func in [
+        ("python scan", lambda: [_filter_rows(rows, q, 300) for q in queries]),
+        (
+            "search_goods",
+            lambda: [db.search_goods(q, sell_price=("<", 300)) for q in queries],
+        ),
+    ]:
+        elapsed = _timed(func)
+        print("%-12s %10.2f ms/query" % (name, elapsed * 1000 / len(queries)))
+
+
+def _resum_check(products, amount):
+    # what update_check_sum did on every change, minus the Tk round trips
+    rows = []
+    for product in products:
+        rows.append((product.name, amount, product.sell_price * amount))
+        total = sum(row[2] for row in rows)
+    return total
+
+
+def _model_check(products, amount):
+    check = Check()
+    for product in products:
+        check.add(product, amount)
+    for key in list(check.lines)[::2]:
+        check.remove(key)
+    return check.total
+
+
+def run_check(db, _):
+    fill_goods(db, _goods_count)
+    index = GoodsIndex(db)
+    index.update()
+    products = list(index)
+    for name, func in [("re-sum", _resum_check), ("Check", _model_check)]:
+        elapsed = _timed(func, products, 2)
+        print("%-12s %10.0f lines/s" % (name, len(products) / elapsed))
+
+
+def write_delivery(filename, lines):
+    """a delivery of new goods, every fifth line restocking an earlier one"""
+    with open(filename, "w", newline="") as f:
+        writer = _csv.writer(f)
+        writer.writerow(delivery.COLUMNS)
+        for i in range(lines):
+            if i % 5 == 4:
+                barcode = 4600000000000 + _rnd.randrange(i // 5 + 1) * 5
+                writer.writerow([barcode, "", "", 10, "", "", "", "", "add"])
+            else:
+                barcode = 4600000000000 + i
+                writer.writerow(
+                    [barcode, "product %d" % i, "bench", 10, 100]
+                    + ["2099-01-01", 50, 1, "insert"]
+                )
+
+
+def run_import(db, filename):
+    fill_goods(db, 0)
+    csv_name = filename + ".csv"
+    write_delivery(csv_name, _delivery_lines)
+    start = _time.perf_counter()
+    count, errors = delivery.import_csv(db, csv_name)
+    elapsed = _time.perf_counter() - start
+    print(
+        "import       %10.0f rows/s, %d rows, %d errors"
+        % (_delivery_lines / elapsed, count, len(errors))
+    )
+    if errors:
+        raise SystemExit(1)
+
+
+def fill_sales(db, count, lines_per_check=_lines_per_check):
+    """count sales spread over checks of lines_per_check lines each"""
+    checks = count // lines_per_check
+    first = db.get_new_check_id()
+    db.executemany(
+        "INSERT INTO checks (id, sum, sell_date) VALUES (?, 0, %d)" % _sell_date,
+        ((i,) for i in range(first, first + checks)),
+    )
+    db.executemany(
+        "INSERT INTO sales (check_id, product_id, amount, sell_date, price) "
+        "VALUES (?, ?, 1, %d, 100)" % _sell_date,
+        (
+            (first + i // lines_per_check, _rnd.randint(1, _goods_count))
+            for i in range(checks * lines_per_check)
+        ),
+    )
+    db.save()
+
+
+def _peak_memory(func, *args):
+    _tracemalloc.start()
+    try:
+        func(*args)
+        return _tracemalloc.get_traced_memory()[1]
+    finally:
+        _tracemalloc.stop()
+
+
+def run_export(db, filename):
+    """rows/s of a sales export and the peak memory it takes, which should
+    not grow with the table, unlike reading the table with get_table"""
+    fill_goods(db, _goods_count)
+    csv_name = filename + ".csv"
+    for count in _export_sales:
+        fill_sales(db, count - db.execute("SELECT COUNT(*) FROM sales").fetchone()[0])
+        elapsed = _timed(export.export_file, db, "sales", csv_name)
+        print(
+            "export %7d sales %8.0f rows/s, peak %6.1f MB, get_table %6.1f MB"
+            % (
+                count,
+                count / elapsed,
+                _peak_memory(export.export_file, db, "sales", csv_name) / 2**20,
+                _peak_memory(db.get_table, "sales") / 2**20,
+            )
+        )
+
+
+def _return_per_row(db, sale_ids, check_ids):
+    # what Cashier._return_sales did before the bulk methods
+    for sale_id in sale_ids:
+        db.return_sale(sale_id)
+    for check_id in check_ids:
+        db.return_check(check_id)
+
+
+def _return_bulk(db, sale_ids, check_ids):
+    with db.transaction():
+        db.return_checks(check_ids)
+        db.return_sales(sale_ids)
+
+
+def run_returns(db, _):
+    """return a mistaken shift: the last _shift_checks checks, all their sales"""
+    generate(db, _shift_sales)
+    last = db.get_new_check_id() - 1
+    check_ids = list(range(last - _shift_checks + 1, last + 1))
+    sale_ids = db.get_checks_sales(check_ids)
+    for name, func in [("per-row", _return_per_row), ("bulk", _return_bulk)]:
+        elapsed = _timed(func, db, sale_ids, check_ids)
+        db._connection.rollback()
+        print(
+            "%-12s %10.1f ms for %d checks, %d sales"
+            % (name, elapsed * 1000, len(check_ids), len(sale_ids))
+        )
+
+
+_SaleTuple = _collections.namedtuple("_SaleTuple", Sale.__slots__)
+
+
+def _rows_tuples(db):
+    return db.get_table("sales")
+
+
+def _rows_strings(db):
+    # what TableView shows, read back as Cashier and Admin did
+    rows = [[str(x) for x in row] for row in db.get_table("sales")]
+    return sum(int(values[3]) for values in rows), rows
+
+
+def _rows_namedtuples(db):
+    rows = list(map(_SaleTuple._make, db.execute(STATEMENTS["sales"]).fetchall()))
+    return sum(sale.amount for sale in rows), rows
+
+
+def _rows_typed(db):
+    rows = Repository(db).sales()
+    return sum(sale.amount for sale in rows), rows
+
+
+def _retained(func, *args):
+    """bytes still allocated by what func returns"""
+    _tracemalloc.start()
+    try:
+        result = func(*args)
+        size = _tracemalloc.get_traced_memory()[0]
+        del result
+        return size
+    finally:
+        _tracemalloc.stop()
+
+
+def run_rows(db, _):
+    """time and memory per sales row read as tuples, as the strings TableView
+    makes of them, as namedtuples and as repository rows"""
+    fill_goods(db, _goods_count)
+    fill_sales(db, _row_sales)
+    for name, func in [
+        ("tuples", _rows_tuples),
+        ("strings", _rows_strings),
+        ("namedtuple", _rows_namedtuples),
+        ("typed", _rows_typed),
+    ]:
+        elapsed = min(_timed(func, db) for _ in range(3))
+        size = _retained(func, db)
+        print(
+            "%-12s %8.2f us/row %8.1f bytes/row"
+            % (name, elapsed / _row_sales * 1e6, size / _row_sales)
+        )
+
+
+def _sell_grouped(group, checks):
+    futures = [group.submit(lines) for lines in checks]
+    for future in futures:
+        future.result()
+
+
+def _till(group, checks):
+    # waits for every check to be committed before the next
+    for lines in checks:
+        group.sell_check(lines)
+
+
+def _sell_tills(group, checks):
+    tills = [
+        _threading.Thread(target=_till, args=(group, checks[i::_group_tills]))
+        for i in range(_group_tills)
+    ]
+    for till in tills:
+        till.start()
+    for till in tills:
+        till.join()
+
+
+def run_group(db, filename):
+    """checks/s sold with a commit per check and through group commits,
+    all at once and from tills waiting for each of their checks"""
+    fill_goods(db, _goods_count)
+    checks = random_checks(_goods_count, _group_checks, _lines_per_check)
+    elapsed = _timed(sell_check, db, checks)
+    print("%-12s %10.0f checks/s" % ("per-check", _group_checks / elapsed))
+    for name, sync in [("group", False), ("group+fsync", True)]:
+        group = groupcommit.GroupCommit(filename, sync=sync)
+        elapsed = _timed(_sell_grouped, group, checks)
+        group.close()
+        print("%-12s %10.0f checks/s" % (name, _group_checks / elapsed))
+    # a till waits interval at most for others to join its commit
+    for interval in _group_intervals:
+        group = groupcommit.GroupCommit(filename, interval=interval / 1000)
+        elapsed = _timed(_sell_tills, group, checks)
+        group.close()
+        print(
+            "%d tills, %2d ms %6.0f checks/s"
+            % (_group_tills, interval, _group_checks / elapsed)
+        )
+
+
+_benchmarks = {
+    "plans": lambda db, _: check_plans(db),
+    "checkout": run_checkout,
+    "terminals": run_terminals,
+    "index": run_index,
+    "search": run_search,
+    "check": run_check,
+    "import": run_import,
+    "export": run_export,
+    "returns": run_returns,
+    "rows": run_rows,
+    "group": run_group,
+}
+
+
+def generate(db, sales, goods=_goods_count, lines_per_check=5, days=365, seed=0):
+    """a synthetic shop: goods, a client per hundred sales with a bonus code,
+    and checks of 1 to 2 * lines_per_check - 1 lines spread over the last days,
+    a third of them to clients; check sums match their sales"""
+    rnd = _rnd.Random(seed)
+    fill_goods(db, goods)
+    db.execute("DELETE FROM clients")
+    prices = dict(db.execute("SELECT id, sell_price FROM goods").fetchall())
+
+    today = dates.today()
+    clients = max(10, sales // 100)
+    codes = ["%06d" % code for code in rnd.sample(range(10**6), clients)]
+    db.executemany(
+        "INSERT INTO clients VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (i, "+7900%07d" % i, "client %d" % i, rnd.randint(0, 50), code, today)
+            for i, code in enumerate(codes, 1)
+        ),
+    )
+
+    check_id = 0
+    while sales > 0:
+        checks, lines = [], []
+        for _ in range(10000):
+            if sales <= 0:
+                break
+            check_id += 1
+            sell_date = dates.day_start(today - rnd.randrange(days))
+            sell_date += rnd.randrange(86400)
+            count = min(sales, rnd.randint(1, 2 * lines_per_check - 1))
+            sales -= count
+            sum_ = 0
+            for _ in range(count):
+                product_id, amount = rnd.randint(1, goods), rnd.randint(1, 3)
+                lines.append(
+                    (check_id, product_id, amount, sell_date, prices[product_id])
+                )
+                sum_ += amount * prices[product_id]
+            client = rnd.randint(1, clients) if rnd.random() < 1 / 3 else None
+            checks.append((check_id, sum_, client, sell_date))
+        db.executemany(
+            "INSERT INTO checks (id, sum, bonuses, client_id, sell_date) "
+            "VALUES (?, ?, 0, ?, ?)",
+            checks,
+        )
+        db.executemany(
+            "INSERT INTO sales (check_id, product_id, amount, sell_date, price) "
+            "VALUES (?, ?, ?, ?, ?)",
+            lines,
+        )
+    db.save()
+
+
+def _call_each(func, calls):
+    for args in calls:
+        func(*args)
+
+
+def _suite_sell_product(db, rnd, calls):
+    check_id = db.get_new_check_id()
+    db.add_check(check_id, 0, 0, None)
+    return db.sell_product, [
+        (check_id, rnd.randint(1, _goods_count), 1) for _ in range(calls)
+    ]
+
+
+def _suite_return_sale(db, rnd, calls):
+    last = db.execute("SELECT MAX(id) FROM sales").fetchone()[0]
+    return db.return_sale, [(id_,) for id_ in rnd.sample(range(1, last + 1), calls)]
+
+
+def _suite_return_check(db, rnd, calls):
+    last = db.get_new_check_id() - 1
+    ids = rnd.sample(range(1, last + 1), min(calls, last))
+    return db.return_check, [(id_,) for id_ in ids]
+
+
+def _suite_generate_codes(db, rnd, calls):
+    db.execute("UPDATE clients SET code_date = 0")
+    db.save()
+    return db.generate_codes, [()]
+
+
+def _suite_get_client_by_code(db, rnd, calls):
+    codes = [row[0] for row in db.execute("SELECT bonus_code FROM clients")]
+    return db.get_client_by_code, [(rnd.choice(codes),) for _ in range(calls)]
+
+
+# name, setup(db, rnd, calls) returning the method to time and the arguments
+# of each call, and the number of calls
+_suite = [
+    ("sell_product", _suite_sell_product, _suite_calls),
+    ("return_sale", _suite_return_sale, _suite_calls),
+    ("return_check", _suite_return_check, _suite_calls),
+    ("generate_codes", _suite_generate_codes, 1),
+    ("get_client_by_code", _suite_get_client_by_code, _suite_calls),
+    ("get_table", lambda db, rnd, calls: (db.get_table, [("sales",)]), 1),
+    (
+        "get_new_check_id",
+        lambda db, rnd, calls: (db.get_new_check_id, [()] * calls),
+        _suite_calls,
+    ),
+]
+
+
+def run_tier(filename, sales):
+    """seconds per call of every suite operation, best of _suite_repeats,
+    on a fresh database of the given number of sales; writes are rolled
+    back after each run, so every run sees the same data"""
+    db = Database(filename)
+    print("tier %d sales: generated in %.1f s" % (sales, _timed(generate, db, sales)))
+    rnd = _rnd.Random(1)
+    results = {}
+    for name, setup, calls in _suite:
+        best = None
+        for _ in range(_suite_repeats):
+            func, args = setup(db, rnd, calls)
+            elapsed = _timed(_call_each, func, args) / len(args)
+            db._connection.rollback()
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+        print("  %-20s %12.6f ms/call" % (name, best * 1000))
+    db.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """(tier, operation, ratio) for every operation more than threshold
+    slower than in baseline"""
+    slower = []
+    for tier, ops in results.items():
+        for name, seconds in ops.items():
+            base = baseline.get(tier, {}).get(name)
+            if base and seconds / base > 1 + threshold:
+                slower.append((tier, name, seconds / base))
+    return slower
+
+
+def _run_confirmed(tmp, tier, stored, threshold):
+    """run_tier(), again on a fresh database while a gated tier is slower
+    than stored, keeping the best time of every operation"""
+    results = run_tier(_path.join(tmp, "suite-%s.sqlite3" % tier), _tiers[tier])
+    for i in range(_confirm_runs):
+        if tier not in _gated_tiers or not compare({tier: results}, stored, threshold):
+            break
+        print("  slower than the baseline, running the tier again")
+        filename = _path.join(tmp, "suite-%s-%d.sqlite3" % (tier, i + 1))
+        again = run_tier(filename, _tiers[tier])
+        results = {name: min(results[name], again[name]) for name in results}
+    return results
+
+
+def run_suite(
+    tiers, output=None, baseline=_baseline, threshold=_threshold, save_baseline=False
+):
+    stored = {}
+    if not save_baseline and _path.exists(baseline):
+        with open(baseline) as f:
+            stored = _json.load(f)["tiers"]
+    results = {"sqlite": _sql.sqlite_version, "tiers": {}}
+    with _tmp.TemporaryDirectory() as tmp:
+        for tier in tiers:
+            results["tiers"][tier] = _run_confirmed(tmp, tier, stored, threshold)
+        Database.close_connection()
+
+    if output:
+        with open(output, "w") as f:
+            _json.dump(results, f, indent=2)
+            f.write("\n")
+    if save_baseline:
+        with open(baseline, "w") as f:
+            _json.dump(results, f, indent=2)
+            f.write("\n")
+        return
+    if not stored:
+        print("no baseline at %s" % baseline)
+        return
+    slower = compare(results["tiers"], stored, threshold)
+    failed = False
+    for tier, name, ratio in slower:
+        gated = tier in _gated_tiers
+        failed = failed or gated
+        print(
+            "%s: %s %s is %.2f times slower"
+            % ("regression" if gated else "not gated", tier, name, ratio)
+        )
+    if failed:
+        raise SystemExit(1)
+    print("no regressions over %d%%" % (threshold * 100))
+
+
+def run(names=None):
+    with _tmp.TemporaryDirectory() as tmp:
+        filename = _path.join(tmp, "bench.sqlite3")
+        db = Database(filename)
+        for name in names or _benchmarks:
+            _benchmarks[name](db, filename)
+        db.close()
+        Database.close_connection()
+
+
+def main(args=None):
+    parser = _argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument("names", nargs="*", metavar="benchmark")
+    parser.add_argument("--tiers", default=",".join(_tiers))
+    parser.add_argument("--output")
+    parser.add_argument("--baseline", default=_baseline)
+    parser.add_argument("--threshold", type=float, default=_threshold)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(args)
+
+    unknown = set(args.names) - set(_benchmarks) - {"suite"}
+    unknown |= set(args.tiers.split(",")) - set(_tiers)
+    if unknown:
+        parser.error("unknown benchmarks or tiers: %s" % ", ".join(sorted(unknown)))
+    if "suite" in args.names:
+        run_suite(
+            args.tiers.split(","),
+            args.output,
+            args.baseline,
+            args.threshold,
+            args.save_baseline,
+        )
+    names = [name for name in args.names if name != "suite"]
+    if names or not args.names:
+        run(names)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import functools as _ft
+import sys
 import tkinter as _tk
 import tkinter.messagebox as _msg
 import tkinter.ttk as _ttk
@@ -5,23 +7,74 @@ import tkinter.ttk as _ttk
 import dates
 import logo
 import util
+from check import Check
 from db_sqlite import Database
+from goods_index import GoodsIndex
 from login import Login, Roles
+from repository import Repository
 from style import Button, Entry
-from tableview import TableView
+from tableview import PagedTableView, TableView
 from tabs import Tabs
 from window import Window
+from worker import Worker
 
 __all__ = ["Cashier"]
 
+# milliseconds of typing pause before the goods are searched
+_search_delay = 250
+
+
+def _check_sales(db, check_ids, sale_ids):
+    return set(sale_ids).union(db.get_checks_sales(check_ids))
+
+
+def _find_client(db, code):
+    return Repository(db).client_by_code(code)
+
+
+def _sell_check(db, lines, client_id, use_bonuses):
+    # through the group commit while it runs, its writer sells on its own;
+    # main imports groupcommit only when it is enabled
+    groupcommit = sys.modules.get("groupcommit")
+    group = groupcommit and groupcommit.current()
+    if group is not None:
+        try:
+            future = group.submit(lines, client_id, use_bonuses)
+        except RuntimeError:  # stopped by an error meanwhile
+            pass
+        else:
+            return future.result()
+    return db.sell_check(None, lines, client_id, use_bonuses)
+
+
+def _return_sales(db, sale_ids, check_ids):
+    with db.transaction():
+        # sales of the returned checks are gone by then
+        db.return_checks(check_ids)
+        db.return_sales(sale_ids)
+
 
 class Cashier(Window):
     def __init__(self, is_admin=False):
         super().__init__("Касса")
         self._is_admin = is_admin
         self.db = Database()
+        self.worker = Worker(self)
+        self.worker.on_busy = self.on_busy
+        self._db_buttons = []
+        self._index = GoodsIndex(self.db, self.worker)
+        self._check_model = Check()
         self.create_widgets()
 
+    def destroy(self):
+        self.worker.stop()
+        super().destroy()
+
+    def on_busy(self, busy):
+        self.config(cursor="watch" if busy else "")
+        for button in self._db_buttons:
+            button.state(["disabled" if busy else "!disabled"])
+
     def create_widgets(self):
         logo.get_label(self).pack()
 
@@ -58,11 +111,17 @@ class Cashier(Window):
             c for c in goods_cols if c not in ["ID", "Закупочная цена", "Бонусы"]
         ]
         self._goods = TableView(
-            frame, self.db, "goods", goods_cols, self.on_good_select
+            frame,
+            self.db,
+            "goods",
+            goods_cols,
+            self.on_good_select,
+            self.worker,
+            {5: dates.from_day},
         )
         self._goods.config(displaycolumns=display_columns)
         self._goods.grid(column=0, row=1, sticky="nsew", padx=20)
-        self._goods.update_data()
+        self.update_goods()
 
         self._sell_frame = _ttk.Frame(frame)
         self.create_entries(self._sell_frame)
@@ -82,7 +141,9 @@ class Cashier(Window):
         self._check_sum = 0
         self._sum_label = _ttk.Label(check_frame, text="Сумма: 0")
         self._sum_label.pack(pady=5)
-        Button(check_frame, text="Продать", command=self.on_sell).pack(pady=5)
+        sell = Button(check_frame, text="Продать", command=self.on_sell)
+        sell.pack(pady=5)
+        self._db_buttons.append(sell)
         Button(check_frame, text="Вернуть", command=self.on_return).pack(pady=5)
         _ttk.Label(check_frame, text="Код клиента").pack()
         self._client_code = Entry(check_frame)
@@ -101,6 +162,7 @@ class Cashier(Window):
 
         self.add = Button(master, text="Добавить", command=self.on_add_item)
         self.add.grid(column=0, row=2, columnspan=2, pady=5)
+        self._db_buttons.append(self.add)
 
         Button(master, text="Поиск", command=self.toggle_search).grid(
             column=0, row=3, columnspan=3, pady=5
@@ -118,85 +180,68 @@ class Cashier(Window):
         Button(frame, text="Сбросить поиск", command=self.clear_search).grid(
             column=0, row=last_row + 1, columnspan=2, pady=10
         )
-        self._hidden_items = []
+        self._search_job = None
 
     def is_number_valid(self, value):
         return value.isdigit() and int(value) >= 0
 
-    def validate_search(self):
-        amount, price, use_by = [e.get_strip() for e in self._search_entries[2:]]
-        if amount and amount[0] in "<>" and len(amount) > 1:
-            amount = amount[1:]
-        if price and price[0] in "<>" and len(price) > 1:
-            price = price[1:]
-        if use_by and use_by[0] in "<>" and len(use_by) > 1:
-            use_by = use_by[1:]
+    def split_operator(self, text):
+        if text and text[0] in "<>" and len(text) > 1:
+            return text[0], text[1:]
+        return "=", text
+
+    def validate_search(self, quiet=False):
+        show_error = (lambda _: False) if quiet else util.show_error
+        amount, price, use_by = [
+            self.split_operator(e.get_strip())[1] for e in self._search_entries[2:]
+        ]
 
         if amount and (not amount.isdigit() or int(amount) < 0):
-            return util.show_error(
-                "Количество должно быть целым неотрицательным числом"
-            )
+            return show_error("Количество должно быть целым неотрицательным числом")
         if price and not self.is_number_valid(price):
-            return util.show_error("Цена должна быть целым неотрицательным числом")
-        if use_by and not dates.to_date(use_by):
-            return util.show_error("Введите дату (ГГГГ-ММ-ДД)")
+            return show_error("Цена должна быть целым неотрицательным числом")
+        if use_by and dates.to_day(use_by) is None:
+            return show_error("Введите дату (ГГГГ-ММ-ДД)")
         return True
 
-    def _compare_values(self, x, value, operator, type_):
-        if type_ == "num":
-            x = int(x)
-        elif type_ == "date":
-            x = dates.to_date(x)
-
-        if operator == ">":
-            return x > value
-        elif operator == "<":
-            return x < value
-        return x == value
-
-    def on_search(self):
-        if not self.validate_search():
+    def on_search(self, quiet=False):
+        self._search_job = None
+        if not self.validate_search(quiet):
             return
 
-        items_to_keep = list(self._goods.get_children())
-
-        # search filters
-        for i in range(len(self._search_entries)):
-            text = self._search_entries[i].get_strip()
+        name, manufacturer, *texts = [e.get_strip() for e in self._search_entries]
+        ranges = {}
+        for column, text in zip(["amount", "sell_price", "use_by"], texts):
             if not text:
                 continue
-            if i < 2:  # name and manufacturer
-                comparer = lambda x: text.lower() in x.lower()
-            else:  # numbers (>, <, =)
-                operator = "="
-                if text[0] in "<>":
-                    operator = text[0]
-                    text = text[1:]
-                if i == 4:
-                    value = dates.to_date(text)
-                else:
-                    value = int(text)
-                comparer = lambda x: self._compare_values(
-                    x, value, operator, "date" if i == 4 else "num"
-                )
-            items_to_keep = list(
-                filter(
-                    lambda row: comparer(self._goods.item(row)["values"][i + 1]),
-                    items_to_keep,
-                )
-            )
-
-        for row in self._goods.get_children():
-            if row not in items_to_keep:
-                self._goods.detach(row)
-                self._hidden_items.append(row)
+            operator, value = self.split_operator(text)
+            if column == "use_by":
+                value = dates.to_day(value)
+            else:
+                value = int(value)
+            ranges[column] = (operator, value)
+
+        search = _ft.partial(
+            Database.search_goods, name=name, manufacturer=manufacturer, **ranges
+        )
+        self.worker.submit(search, on_done=self.show_goods)
+
+    def show_goods(self, ids):
+        iids = [str(id_) for id_ in ids]
+        shown = [iid for iid in iids if self._goods.exists(iid)]
+        self._goods.set_children("", *shown)
+        if len(shown) < len(iids):
+            # goods added by another till or a delivery since the last refresh,
+            # the refresh adds them to the view
+            self.update_goods()
+
+    def on_search_typed(self, _):
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(_search_delay, lambda: self.on_search(quiet=True))
 
     def clear_search(self):
-        children = list(self._goods.get_children()) + self._hidden_items
-        children.sort()
-
-        for row, i in zip(children, range(len(children))):
-            self._goods.reattach(row, "", i)
+        self.show_goods(sorted(product.id for product in self._index))
 
         for e in self._search_entries:
             e.delete(0, "end")
@@ -210,6 +255,7 @@ class Cashier(Window):
             e = Entry(master)
             entries.append(e)
             e.grid(column=1, row=i, padx=5, pady=5)
+            e.bind("<KeyRelease>", self.on_search_typed)
         return len(self._goods_cols)
 
     def toggle_search(self):
@@ -230,18 +276,29 @@ class Cashier(Window):
         frame.grid_columnconfigure(1, weight=2)
         frame.grid_rowconfigure(0, weight=1)
 
-        self._checks = TableView(
-            frame, self.db, "checks", ["ID чека", "Сумма", "Бонусы", "ID клиента"]
+        self._checks = PagedTableView(
+            frame,
+            self.db,
+            "checks",
+            ["ID чека", "Сумма", "Бонусы", "ID клиента"],
+            worker=self.worker,
         )
         self._checks.grid(column=0, row=0, sticky="nsew", padx=5, pady=5)
 
-        self._sales = TableView(frame, self.db, "sales", column_names)
+        self._sales = PagedTableView(
+            frame,
+            self.db,
+            "sales",
+            column_names,
+            worker=self.worker,
+            formats={4: dates.from_time},
+        )
         self._sales.config(displaycolumns=display_columns)
         self._sales.grid(column=1, row=0, sticky="nsew", padx=5, pady=5)
 
-        Button(frame, text="Вернуть", command=self.on_return_sales).grid(
-            column=0, row=1, columnspan=2, pady=10
-        )
+        button = Button(frame, text="Вернуть", command=self.on_return_sales)
+        button.grid(column=0, row=1, columnspan=2, pady=10)
+        self._db_buttons.append(button)
 
         self.update_sales()
 
@@ -251,43 +308,33 @@ class Cashier(Window):
         self._checks.update_data()
         self._sales.update_data()
 
-    def find_sales(self, check_id):
-        result = []
-        for row in self._sales.get_children():
-            values = self._sales.item(row)["values"]
-            if values[1] == check_id:
-                result.append(row)
-        return result
-
     def on_return_sales(self):
         if not self._checks.selection() and not self._sales.selection():
             return util.show_error("Выберите хотя бы один чек или товар для возврата")
 
-        selected_sales = list(self._sales.selection())
-
-        for check in self._checks.selection():
-            check_id = self._checks.item(check)["values"][0]
-            selected_sales += self.find_sales(check_id)
-        selected_sales = set(selected_sales)
+        # строки таблиц помечены ID записей, не все продажи чека могут быть загружены
+        check_ids = [int(check) for check in self._checks.selection()]
+        sale_ids = [int(sale) for sale in self._sales.selection()]
+        self.worker.submit(
+            _check_sales,
+            check_ids,
+            sale_ids,
+            on_done=lambda sale_ids: self.confirm_return_sales(check_ids, sale_ids),
+        )
 
+    def confirm_return_sales(self, check_ids, sale_ids):
         if not _msg.askyesno(
             "Подтверждение",
-            "Вернуть чеков: %d, товаров: %d?"
-            % (len(self._checks.selection()), len(selected_sales)),
+            "Вернуть чеков: %d, товаров: %d?" % (len(check_ids), len(sale_ids)),
         ):
             return
+        self.worker.submit(
+            _return_sales, sale_ids, check_ids, on_done=lambda _: self.on_returned()
+        )
 
-        for sale in selected_sales:
-            # ID записи в первом столбце (скрытом)
-            values = self._sales.item(sale)["values"]
-            self.db.return_sale(values[0])
-
-        for check in self._checks.selection():
-            values = self._checks.item(check)["values"]
-            self.db.return_check(values[0])
-
+    def on_returned(self):
         self.update_sales()
-        self._goods.update_data()
+        self.update_goods()
 
     def create_confirm_window(self):
         self.confirm_window = _tk.Toplevel(self)
@@ -323,18 +370,18 @@ class Cashier(Window):
         ).pack()
         util.center_window(win)
 
-    def find_row(self, table, name):
-        for row in table.get_children():
-            if name == table.item(row)["values"][1]:
-                return row, table.item(row)["values"]
-        return None, None
+    def update_goods(self):
+        self._goods.update_data()
+        self._index.update()
 
-    def on_good_select(self, _, selected):
-        if len(selected["values"]) < 2:
+    def on_good_select(self, *_):
+        focus = self._goods.focus()
+        product = self._index.get(int(focus)) if focus else None
+        if product is None:
             return
         self._name.delete(0, "end")
         self._amount.delete(0, "end")
-        self._name.insert(0, selected["values"][1])
+        self._name.insert(0, product.name)
         self._amount.insert(0, 1)
         self._name.focus()
 
@@ -343,46 +390,54 @@ class Cashier(Window):
         if not name:
             return util.show_error("Введите наименование")
 
-        row, values = self.find_row(self._goods, name)
+        product = self._index.find(name)
 
-        if not row:
+        if not product:
             return util.show_error("Товар не найден")
         if not amount.isdigit() or int(amount) <= 0:
             return util.show_error("Количество должно быть целым положительным числом")
         amount = int(amount)
-        if amount > values[3]:
+        if amount > product.amount:
             return util.show_error("Нельзя продать больше товаров, чем есть в наличии")
 
-        self.change_by_amount(-amount, row)
-        self.add_to_check(name, amount, row)
+        self.change_by_amount(-amount, product)
+        self.add_to_check(amount, product)
         self.update_check_sum()
 
         self._name.delete(0, "end")
         self._amount.delete(0, "end")
 
-    def change_by_amount(self, amount, row):
-        values = self._goods.item(row)["values"]
-        values[3] += amount
-        self._goods.item(row, values=values)
+    def change_by_amount(self, amount, product):
+        self._index.change_amount(product.id, amount)
+        self._goods.set(str(product.id), "Количество", product.amount)
 
-    def add_to_check(self, name, amount, row):
-        cost = amount * self._goods.item(row)["values"][4]
-        self._check.insert("", "end", values=(name, amount, cost))
+    def add_to_check(self, amount, product):
+        key = self._check_model.add(product, amount)
+        line = self._check_model.lines[key]
+        self._check.insert("", "end", iid=key, values=(line.name, amount, line.cost))
 
     def on_sell(self, use_bonuses=None):
-        if len(self._check.get_children()) == 0:
+        if len(self._check_model) == 0:
             return util.show_error("В чеке нет товаров")
-        if len(self._client_code.get_strip()) == 0:
+        code = self._client_code.get_strip()
+        if len(code) == 0:
             result = _msg.askyesno("Подтверждение", "Не вводить код клиента?")
             if not result:
                 return
-            client_id, bonuses = None, 0
+            self.sell(None, 0, use_bonuses)
         else:
-            data = self.db.get_client_by_code(self._client_code.get_strip())
-            if not data:
-                return util.show_error("Клиент не найден")
-            client_id, bonuses = data
+            self.worker.submit(
+                _find_client,
+                code,
+                on_done=lambda client: self.on_client_found(client, use_bonuses),
+            )
+
+    def on_client_found(self, client, use_bonuses):
+        if client is None:
+            return util.show_error("Клиент не найден")
+        self.sell(client.id, client.bonuses, use_bonuses)
 
+    def sell(self, client_id, bonuses, use_bonuses):
         if client_id is not None and use_bonuses is None and bonuses > 0:
             if _msg.askyesno("Бонусы", "Хотите использовать до %d бонусов?" % bonuses):
                 self.create_bonus_window(bonuses)
@@ -393,25 +448,19 @@ class Cashier(Window):
 
         use_bonuses = 0 if use_bonuses is None else use_bonuses
 
-        self.db.add_check(self._check_id, self._check_sum, use_bonuses, client_id)
-        add_bonuses = 0
-        for row in self._check.get_children():
-            values = self._check.item(row)["values"]
-            goods_row = self.find_row(self._goods, values[0])[1]
-            product_id = goods_row[0]
-            if goods_row[-2] > 0:
-                add_bonuses += goods_row[-2]
-
-            amount = self._check.item(row)["values"][1]
-            self.db.sell_product(self._check_id, product_id, amount)
+        self.worker.submit(
+            _sell_check,
+            self._check_model.sale_lines(),
+            client_id,
+            use_bonuses,
+            on_done=lambda result: self.on_sold(result, client_id, use_bonuses),
+        )
 
-        if client_id:
-            self.db.change_bonuses(client_id, add_bonuses - use_bonuses)
+    def on_sold(self, result, client_id, use_bonuses):
+        self._check_id, self._check_sum, add_bonuses = result
+        self._check_model.clear()
         self._check.clear()
-        self.db.save()
 
-        if use_bonuses:
-            self._check_sum -= use_bonuses * 10
         message = "Чек №%d на сумму %d" % (self._check_id, self._check_sum)
         if client_id and use_bonuses > 0:
             message += " (бонусов использовано: %d)" % use_bonuses
@@ -449,22 +498,21 @@ class Cashier(Window):
             return util.show_error("Выберите товары для возврата")
 
         for row in self._check.selection():
-            values = self._check.item(row)["values"]
-            _goods_row, _ = self.find_row(self._goods, values[0])
-            self.change_by_amount(values[1], _goods_row)
+            line = self._check_model.remove(row)
+            self.change_by_amount(line.amount, self._index.get(line.product_id))
             self._check.delete(row)
 
         self.update_check_sum()
 
     def update_check_id(self):
-        self._check_id = self.db.get_new_check_id()
+        self.worker.submit(Database.get_new_check_id, on_done=self.show_check_id)
+
+    def show_check_id(self, check_id):
+        self._check_id = check_id
         self._check_text.config(text="Чек №%d" % self._check_id)
 
     def update_check_sum(self):
-        result = 0
-        for row in self._check.get_children():
-            result += self._check.item(row)["values"][2]
-        self._check_sum = result
+        self._check_sum = self._check_model.total
         self._sum_label.config(text="Сумма: %d" % self._check_sum)
 
 
@@ -0,0 +1,60 @@
+__all__ = ["CheckLine", "Check"]
+
+
+class CheckLine:
+    """one position of a check being assembled; money is in whole rubles"""
+
+    __slots__ = ("product_id", "name", "price", "amount", "bonuses")
+
+    def __init__(self, product_id, name, price, amount, bonuses):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.amount = amount
+        self.bonuses = bonuses
+
+    @property
+    def cost(self):
+        return self.price * self.amount
+
+
+class Check:
+    """lines of an unpaid check with a running total and bonus accrual;
+    lines are keyed by strings that double as Treeview item ids"""
+
+    __slots__ = ("lines", "total", "bonuses", "_next_key")
+
+    def __init__(self):
+        self.lines = {}
+        self.total = 0
+        self.bonuses = 0
+        self._next_key = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, product, amount):
+        """add amount of a goods_index.Product, return the new line's key"""
+        self._next_key += 1
+        key = "L%d" % self._next_key
+        line = self.lines[key] = CheckLine(
+            product.id, product.name, product.sell_price, amount, product.bonuses
+        )
+        self.total += line.cost
+        self.bonuses += line.bonuses
+        return key
+
+    def remove(self, key):
+        line = self.lines.pop(key)
+        self.total -= line.cost
+        self.bonuses -= line.bonuses
+        return line
+
+    def clear(self):
+        self.lines.clear()
+        self.total = 0
+        self.bonuses = 0
+
+    def sale_lines(self):
+        """(product_id, amount) pairs for Database.sell_check"""
+        return [(line.product_id, line.amount) for line in self.lines.values()]
@@ -1,6 +1,20 @@
+"""dates as the database keeps them: days are whole days since 1970-01-01
+and times are seconds since then, so that ranges are plain integer
+comparisons and use indexes as they are. Times are stored in UTC like
+SQLite's own clock, but shown in local time; today() is the local day,
+which bonus codes rotate on"""
 import datetime as _dt
+import functools as _ft
+import time as _time
 
 _date_format = "%Y-%m-%d"
+_time_format = "%Y-%m-%d %H:%M"
+
+_day_seconds = 86400
+_epoch_ordinal = _dt.date(1970, 1, 1).toordinal()
+
+# days seen in a table are few, so conversions are cached
+_cache_size = 4096
 
 
 def to_date(s):
@@ -12,3 +26,48 @@ def to_date(s):
 
 def from_date(date):
     return date.strftime(_date_format)
+
+
+def day_of(date):
+    """day number of a datetime.date"""
+    return date.toordinal() - _epoch_ordinal
+
+
+def date_of(day):
+    """datetime.date of a day number"""
+    return _dt.date.fromordinal(day + _epoch_ordinal)
+
+
+@_ft.lru_cache(maxsize=_cache_size)
+def to_day(s):
+    """day number of a YYYY-MM-DD string, None if it is not a valid date"""
+    date = to_date(s)
+    return None if date is False else day_of(date)
+
+
+@_ft.lru_cache(maxsize=_cache_size)
+def from_day(day):
+    """YYYY-MM-DD string of a day number, an empty one for None"""
+    return "" if day is None else from_date(date_of(day))
+
+
+def to_days(strings):
+    """to_day of each string, None for empty ones too"""
+    return list(map(to_day, strings))
+
+
+def from_time(seconds):
+    """YYYY-MM-DD HH:MM string of a time, in local time"""
+    if seconds is None:
+        return ""
+    return _time.strftime(_time_format, _time.localtime(seconds))
+
+
+def today():
+    """day number of the local date"""
+    return day_of(_dt.date.today())
+
+
+def day_start(day):
+    """time of the first second of day"""
+    return day * _day_seconds
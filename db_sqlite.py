@@ -1,20 +1,92 @@
-import datetime as _dt
+import atexit as _atexit
+import contextlib as _contextlib
+import functools as _ft
+import json as _json
 import os.path as _path
 import random as _rnd
 import sqlite3 as _sql
+import threading as _threading
+import time as _time
 
 import dates as _dates
+import querystats as _querystats
 
-__all__ = ["Database"]
+__all__ = ["Database", "busy_stats", "connect", "disconnect", "shutdown"]
 
 _default_name = _path.dirname(__file__) + "/files/coffee.sqlite3"
 
+# seconds sqlite waits on a locked database before a write gives up,
+# after which the whole write is retried with exponential backoff
+_busy_timeout = 5.0
+_busy_retries = 5
+_busy_backoff = 0.05
+
+# locked-database errors met by _retry_busy in this process: every error,
+# the retries made after them and the writes that gave up
+_busy_counts = {"busy": 0, "retries": 0, "failed": 0}
+
+# one statement for every delivery action, so records apply in file order
+_upsert_goods = """
+INSERT INTO goods (id, name, manufacturer, amount, sell_price, use_by,
+    purchase_price, bonuses)
+VALUES (:id, COALESCE(:name, ''), COALESCE(:manufacturer, ''), :amount,
+    COALESCE(:sell_price, 0), :use_by,
+    COALESCE(:purchase_price, 0), COALESCE(:bonuses, 0))
+ON CONFLICT (id) DO UPDATE SET
+    amount = CASE :action WHEN 'add' THEN amount + :amount ELSE :amount END,
+    name = CASE :action WHEN 'update' THEN :name ELSE name END,
+    manufacturer = CASE :action WHEN 'update' THEN :manufacturer
+        ELSE manufacturer END,
+    sell_price = CASE WHEN :action = 'update' AND :sell_price IS NOT NULL
+        THEN :sell_price ELSE sell_price END,
+    use_by = CASE WHEN :action = 'update' AND :use_by IS NOT NULL
+        THEN :use_by ELSE use_by END,
+    purchase_price = CASE WHEN :action = 'update' AND :purchase_price IS NOT NULL
+        THEN :purchase_price ELSE purchase_price END,
+    bonuses = CASE WHEN :action = 'update' AND :bonuses IS NOT NULL
+        THEN :bonuses ELSE bonuses END
+"""
+
+# rows fetched at a time by Database.iter_query
+_fetch_size = 1000
+
+# bulk returns; ? is a JSON array of ids, %s the column it matches
+_ids = "IN (SELECT value FROM json_each(?))"
+_restock_sales = """
+UPDATE goods SET amount = goods.amount + r.amount
+FROM (SELECT product_id, SUM(amount) AS amount FROM sales WHERE %%s %s
+    GROUP BY product_id) AS r
+WHERE goods.id = r.product_id AND goods.returnable
+""" % _ids
+# as in return_sale, a check paid partly with bonuses that would go
+# negative gets the bonuses back into its sum
+_reduce_checks = """
+UPDATE checks SET
+    sum = MAX(
+        sum - r.cost + CASE WHEN sum < r.cost THEN checks.bonuses * 10 ELSE 0 END, 0
+    ),
+    bonuses = CASE WHEN sum < r.cost THEN 0 ELSE checks.bonuses END
+FROM (SELECT check_id, SUM(amount * price) AS cost FROM sales WHERE id %s
+    GROUP BY check_id) AS r
+WHERE checks.id = r.check_id
+""" % _ids
+
+# the current time as stored in sell_date, see dates
+_now = "CAST(strftime('%s') AS INTEGER)"
+
+_code_count = 10**6
+_code_format = "%06d"
+
+# per-connection settings, applied to every new connection
+_connection_pragmas = [
+    "PRAGMA foreign_keys = 1",
+    "PRAGMA synchronous = NORMAL",
+]
+
+# schema setup, run once per process for each database file
 _init_script = """
 PRAGMA encoding = "UTF-8";
-PRAGMA foreign_keys = 1;
-
 PRAGMA journal_mode = WAL;
-PRAGMA synchronous = NORMAL;
 
 CREATE TABLE IF NOT EXISTS clients (
     id INTEGER PRIMARY KEY,
@@ -62,49 +134,847 @@ CREATE TABLE IF NOT EXISTS logins (
 )
 """
 
+# change log triggers of the tables views follow, see Database.get_changes
+_log_triggers = "".join(
+    """
+CREATE TRIGGER IF NOT EXISTS {0}_insert_log AFTER INSERT ON {0} BEGIN
+    INSERT INTO row_changes VALUES (NULL, '{0}', new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS {0}_update_log AFTER UPDATE ON {0} BEGIN
+    INSERT INTO row_changes VALUES (NULL, '{0}', new.id);
+    INSERT INTO row_changes SELECT NULL, '{0}', old.id WHERE old.id != new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS {0}_delete_log AFTER DELETE ON {0} BEGIN
+    INSERT INTO row_changes VALUES (NULL, '{0}', old.id);
+END;
+""".format(table)
+    for table in ["goods", "checks", "sales"]
+)
+
+_fts_triggers = """
+CREATE TRIGGER IF NOT EXISTS goods_fts_insert AFTER INSERT ON goods BEGIN
+    INSERT INTO goods_fts(rowid, name, manufacturer)
+    VALUES (new.id, new.name, new.manufacturer);
+END;
+CREATE TRIGGER IF NOT EXISTS goods_fts_delete AFTER DELETE ON goods BEGIN
+    INSERT INTO goods_fts(goods_fts, rowid, name, manufacturer)
+    VALUES ('delete', old.id, old.name, old.manufacturer);
+END;
+CREATE TRIGGER IF NOT EXISTS goods_fts_update
+AFTER UPDATE OF id, name, manufacturer ON goods BEGIN
+    INSERT INTO goods_fts(goods_fts, rowid, name, manufacturer)
+    VALUES ('delete', old.id, old.name, old.manufacturer);
+    INSERT INTO goods_fts(rowid, name, manufacturer)
+    VALUES (new.id, new.name, new.manufacturer);
+END;
+"""
+
+# a YYYY-MM-DD or YYYY-MM-DD HH:MM:SS text as seconds since 1970, see dates
+_text_time = "CAST(strftime('%%s', %s) AS INTEGER)"
+
+# day and time columns become integers, tables are rebuilt to change their
+# types; summaries are converted rather than recounted, since they also
+# cover archived days
+_integer_dates = """
+CREATE TABLE clients_new (
+    id INTEGER PRIMARY KEY,
+    phone TEXT NOT NULL,
+    name TEXT NOT NULL,
+    bonuses INTEGER NOT NULL DEFAULT 0 CHECK(bonuses >= 0),
+    bonus_code TEXT NOT NULL,
+    code_date INTEGER NOT NULL
+) STRICT;
+INSERT INTO clients_new
+SELECT id, phone, name, bonuses, bonus_code, COALESCE({code_date} / 86400, 0)
+FROM clients;
+
+CREATE TABLE goods_new (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    manufacturer TEXT NOT NULL,
+    amount INTEGER NOT NULL DEFAULT 0 CHECK(amount >= 0),
+    sell_price INTEGER NOT NULL DEFAULT 0 CHECK(sell_price >= 0),
+    use_by INTEGER,
+    purchase_price INTEGER NOT NULL DEFAULT 0 CHECK(purchase_price >= 0),
+    bonuses INTEGER NOT NULL DEFAULT 0 CHECK(bonuses >= 0),
+    returnable INTEGER NOT NULL DEFAULT 1
+) STRICT;
+INSERT INTO goods_new
+SELECT id, name, manufacturer, amount, sell_price, {use_by} / 86400,
+    purchase_price, bonuses, returnable
+FROM goods;
+
+CREATE TABLE checks_new (
+    id INTEGER PRIMARY KEY,
+    sum INTEGER NOT NULL DEFAULT 0 CHECK(sum >= 0),
+    bonuses INTEGER NOT NULL DEFAULT 0 CHECK(bonuses >= 0),
+    client_id INTEGER DEFAULT NULL,
+    sell_date INTEGER NOT NULL,
+    FOREIGN KEY(client_id) REFERENCES clients(id) ON UPDATE CASCADE
+) STRICT;
+INSERT INTO checks_new
+SELECT id, sum, bonuses, client_id, COALESCE({check_date}, {now}) FROM checks;
+
+CREATE TABLE sales_new (
+    id INTEGER PRIMARY KEY,
+    check_id INTEGER,
+    product_id INTEGER,
+    amount INTEGER NOT NULL DEFAULT 0 CHECK(amount > 0),
+    sell_date INTEGER NOT NULL,
+    price INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY(check_id) REFERENCES checks(id) ON DELETE CASCADE,
+    FOREIGN KEY(product_id) REFERENCES goods(id) ON UPDATE CASCADE
+) STRICT;
+INSERT INTO sales_new
+SELECT id, check_id, product_id, amount, COALESCE({sale_date}, {now}), price
+FROM sales;
+
+DROP TABLE sales;
+DROP TABLE checks;
+DROP TABLE goods;
+DROP TABLE clients;
+ALTER TABLE clients_new RENAME TO clients;
+ALTER TABLE goods_new RENAME TO goods;
+ALTER TABLE checks_new RENAME TO checks;
+ALTER TABLE sales_new RENAME TO sales;
+
+CREATE INDEX sales_check_id ON sales(check_id);
+CREATE INDEX sales_product_date ON sales(product_id, sell_date);
+CREATE INDEX sales_sell_date ON sales(sell_date);
+CREATE INDEX checks_sell_date ON checks(sell_date);
+CREATE INDEX clients_bonus_code ON clients(bonus_code);
+CREATE INDEX clients_phone ON clients(phone);
+CREATE INDEX goods_use_by ON goods(use_by);
+
+CREATE TABLE daily_sales_summary_new (
+    day INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(day, product_id)
+) STRICT, WITHOUT ROWID;
+INSERT INTO daily_sales_summary_new
+SELECT COALESCE({day} / 86400, 0), product_id, SUM(amount), SUM(revenue)
+FROM daily_sales_summary GROUP BY 1, 2;
+
+CREATE TABLE daily_check_summary_new (
+    day INTEGER PRIMARY KEY,
+    checks INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    bonuses INTEGER NOT NULL DEFAULT 0
+) STRICT, WITHOUT ROWID;
+INSERT INTO daily_check_summary_new
+SELECT COALESCE({day} / 86400, 0), SUM(checks), SUM(revenue), SUM(bonuses)
+FROM daily_check_summary GROUP BY 1;
+
+CREATE TABLE hourly_sales_summary_new (
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    lines INTEGER NOT NULL DEFAULT 0,
+    amount INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(day, hour)
+) STRICT, WITHOUT ROWID;
+INSERT INTO hourly_sales_summary_new
+SELECT COALESCE({day} / 86400, 0), CAST(hour AS INTEGER),
+    SUM(lines), SUM(amount), SUM(revenue)
+FROM hourly_sales_summary GROUP BY 1, 2;
+
+DROP TABLE daily_sales_summary;
+DROP TABLE daily_check_summary;
+DROP TABLE hourly_sales_summary;
+ALTER TABLE daily_sales_summary_new RENAME TO daily_sales_summary;
+ALTER TABLE daily_check_summary_new RENAME TO daily_check_summary;
+ALTER TABLE hourly_sales_summary_new RENAME TO hourly_sales_summary;
+CREATE INDEX daily_sales_summary_product
+ON daily_sales_summary(product_id, day, amount, revenue);
+""".format(
+    code_date=_text_time % "code_date",
+    use_by=_text_time % "use_by",
+    check_date=_text_time % "sell_date",
+    sale_date=_text_time % "sell_date",
+    day=_text_time % "day",
+    now=_now,
+)
+
+# summaries of the integer sale times: days are sell_date / 86400,
+# hours (sell_date % 86400) / 3600
+_summary_triggers = """
+CREATE TRIGGER IF NOT EXISTS sales_insert_summary AFTER INSERT ON sales BEGIN
+    INSERT INTO daily_sales_summary VALUES (
+        new.sell_date / 86400, new.product_id, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        amount = amount + excluded.amount, revenue = revenue + excluded.revenue;
+    INSERT INTO hourly_sales_summary VALUES (
+        new.sell_date / 86400, new.sell_date % 86400 / 3600,
+        1, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        lines = lines + 1,
+        amount = amount + excluded.amount,
+        revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_delete_summary AFTER DELETE ON sales BEGIN
+    UPDATE daily_sales_summary SET
+        amount = amount - old.amount, revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date / 86400 AND product_id = old.product_id;
+    UPDATE hourly_sales_summary SET
+        lines = lines - 1,
+        amount = amount - old.amount,
+        revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date / 86400 AND hour = old.sell_date % 86400 / 3600;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_update_summary AFTER UPDATE ON sales BEGIN
+    UPDATE daily_sales_summary SET
+        amount = amount - old.amount, revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date / 86400 AND product_id = old.product_id;
+    UPDATE hourly_sales_summary SET
+        lines = lines - 1,
+        amount = amount - old.amount,
+        revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date / 86400 AND hour = old.sell_date % 86400 / 3600;
+    INSERT INTO daily_sales_summary VALUES (
+        new.sell_date / 86400, new.product_id, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        amount = amount + excluded.amount, revenue = revenue + excluded.revenue;
+    INSERT INTO hourly_sales_summary VALUES (
+        new.sell_date / 86400, new.sell_date % 86400 / 3600,
+        1, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        lines = lines + 1,
+        amount = amount + excluded.amount,
+        revenue = revenue + excluded.revenue;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checks_insert_summary AFTER INSERT ON checks BEGIN
+    INSERT INTO daily_check_summary
+    VALUES (new.sell_date / 86400, 1, new.sum, new.bonuses)
+    ON CONFLICT DO UPDATE SET
+        checks = checks + 1,
+        revenue = revenue + excluded.revenue,
+        bonuses = bonuses + excluded.bonuses;
+END;
+CREATE TRIGGER IF NOT EXISTS checks_delete_summary AFTER DELETE ON checks BEGIN
+    UPDATE daily_check_summary SET
+        checks = checks - 1,
+        revenue = revenue - old.sum,
+        bonuses = bonuses - old.bonuses
+    WHERE day = old.sell_date / 86400;
+END;
+CREATE TRIGGER IF NOT EXISTS checks_update_summary AFTER UPDATE ON checks BEGIN
+    UPDATE daily_check_summary SET
+        checks = checks - 1,
+        revenue = revenue - old.sum,
+        bonuses = bonuses - old.bonuses
+    WHERE day = old.sell_date / 86400;
+    INSERT INTO daily_check_summary
+    VALUES (new.sell_date / 86400, 1, new.sum, new.bonuses)
+    ON CONFLICT DO UPDATE SET
+        checks = checks + 1,
+        revenue = revenue + excluded.revenue,
+        bonuses = bonuses + excluded.bonuses;
+END;
+"""
+_summary_tables = ["daily_sales_summary", "daily_check_summary", "hourly_sales_summary"]
+
+# check ids are never issued again once their checks are archived or
+# returned, so ids stay unique across the live database and its archives
+_checks_autoincrement = """
+CREATE TABLE checks_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sum INTEGER NOT NULL DEFAULT 0 CHECK(sum >= 0),
+    bonuses INTEGER NOT NULL DEFAULT 0 CHECK(bonuses >= 0),
+    client_id INTEGER DEFAULT NULL,
+    sell_date INTEGER NOT NULL,
+    FOREIGN KEY(client_id) REFERENCES clients(id) ON UPDATE CASCADE
+) STRICT;
+INSERT INTO checks_new SELECT id, sum, bonuses, client_id, sell_date FROM checks;
+DROP TABLE checks;
+ALTER TABLE checks_new RENAME TO checks;
+CREATE INDEX checks_sell_date ON checks(sell_date);
+"""
+
+# _migrations[i] upgrades a database from user_version i to i + 1
+_migrations = [
+    """
+CREATE INDEX IF NOT EXISTS sales_check_id ON sales(check_id);
+CREATE INDEX IF NOT EXISTS sales_product_date ON sales(product_id, sell_date);
+CREATE INDEX IF NOT EXISTS sales_sell_date ON sales(sell_date);
+CREATE INDEX IF NOT EXISTS clients_bonus_code ON clients(bonus_code);
+CREATE INDEX IF NOT EXISTS clients_phone ON clients(phone);
+""",
+    """
+CREATE TABLE IF NOT EXISTS row_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    tbl TEXT NOT NULL,
+    row_id INTEGER NOT NULL
+) STRICT;
+"""
+    + _log_triggers,
+    """
+CREATE VIRTUAL TABLE IF NOT EXISTS goods_fts USING fts5(
+    name, manufacturer, content='goods', content_rowid='id', tokenize='trigram'
+);
+INSERT INTO goods_fts(goods_fts) VALUES ('rebuild');
+"""
+    + _fts_triggers,
+    """
+ALTER TABLE sales ADD COLUMN price INTEGER NOT NULL DEFAULT 0;
+UPDATE sales SET price = COALESCE(
+    (SELECT sell_price FROM goods WHERE goods.id = sales.product_id), 0
+);
+ALTER TABLE checks ADD COLUMN sell_date TEXT;
+UPDATE checks SET sell_date = COALESCE(
+    (SELECT MIN(sell_date) FROM sales WHERE sales.check_id = checks.id), date()
+);
+
+CREATE TABLE IF NOT EXISTS daily_sales_summary (
+    day TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(day, product_id)
+) STRICT, WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_check_summary (
+    day TEXT PRIMARY KEY,
+    checks INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    bonuses INTEGER NOT NULL DEFAULT 0
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO daily_sales_summary
+SELECT sell_date, product_id, SUM(amount), SUM(amount * price) FROM sales
+GROUP BY sell_date, product_id;
+INSERT INTO daily_check_summary
+SELECT sell_date, COUNT(*), SUM(sum), SUM(bonuses) FROM checks GROUP BY sell_date;
+
+CREATE TRIGGER IF NOT EXISTS sales_insert_summary AFTER INSERT ON sales BEGIN
+    INSERT INTO daily_sales_summary
+    VALUES (new.sell_date, new.product_id, new.amount, new.amount * new.price)
+    ON CONFLICT DO UPDATE SET
+        amount = amount + excluded.amount, revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_delete_summary AFTER DELETE ON sales BEGIN
+    UPDATE daily_sales_summary SET
+        amount = amount - old.amount, revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date AND product_id = old.product_id;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_update_summary AFTER UPDATE ON sales BEGIN
+    UPDATE daily_sales_summary SET
+        amount = amount - old.amount, revenue = revenue - old.amount * old.price
+    WHERE day = old.sell_date AND product_id = old.product_id;
+    INSERT INTO daily_sales_summary
+    VALUES (new.sell_date, new.product_id, new.amount, new.amount * new.price)
+    ON CONFLICT DO UPDATE SET
+        amount = amount + excluded.amount, revenue = revenue + excluded.revenue;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checks_insert_summary AFTER INSERT ON checks BEGIN
+    INSERT INTO daily_check_summary VALUES (new.sell_date, 1, new.sum, new.bonuses)
+    ON CONFLICT DO UPDATE SET
+        checks = checks + 1,
+        revenue = revenue + excluded.revenue,
+        bonuses = bonuses + excluded.bonuses;
+END;
+CREATE TRIGGER IF NOT EXISTS checks_delete_summary AFTER DELETE ON checks BEGIN
+    UPDATE daily_check_summary SET
+        checks = checks - 1,
+        revenue = revenue - old.sum,
+        bonuses = bonuses - old.bonuses
+    WHERE day = old.sell_date;
+END;
+CREATE TRIGGER IF NOT EXISTS checks_update_summary AFTER UPDATE ON checks BEGIN
+    UPDATE daily_check_summary SET
+        checks = checks - 1,
+        revenue = revenue - old.sum,
+        bonuses = bonuses - old.bonuses
+    WHERE day = old.sell_date;
+    INSERT INTO daily_check_summary VALUES (new.sell_date, 1, new.sum, new.bonuses)
+    ON CONFLICT DO UPDATE SET
+        checks = checks + 1,
+        revenue = revenue + excluded.revenue,
+        bonuses = bonuses + excluded.bonuses;
+END;
+""",
+    """
+CREATE INDEX IF NOT EXISTS daily_sales_summary_product
+ON daily_sales_summary(product_id, day, amount, revenue);
+
+CREATE TABLE IF NOT EXISTS hourly_sales_summary (
+    day TEXT NOT NULL,
+    hour TEXT NOT NULL,
+    lines INTEGER NOT NULL DEFAULT 0,
+    amount INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(day, hour)
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO hourly_sales_summary
+SELECT date(sell_date), strftime('%H', sell_date),
+    COUNT(*), SUM(amount), SUM(amount * price)
+FROM sales GROUP BY 1, 2;
+
+CREATE TRIGGER IF NOT EXISTS sales_insert_hourly AFTER INSERT ON sales BEGIN
+    INSERT INTO hourly_sales_summary VALUES (
+        date(new.sell_date), strftime('%H', new.sell_date),
+        1, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        lines = lines + 1,
+        amount = amount + excluded.amount,
+        revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_delete_hourly AFTER DELETE ON sales BEGIN
+    UPDATE hourly_sales_summary SET
+        lines = lines - 1,
+        amount = amount - old.amount,
+        revenue = revenue - old.amount * old.price
+    WHERE day = date(old.sell_date) AND hour = strftime('%H', old.sell_date);
+END;
+CREATE TRIGGER IF NOT EXISTS sales_update_hourly AFTER UPDATE ON sales BEGIN
+    UPDATE hourly_sales_summary SET
+        lines = lines - 1,
+        amount = amount - old.amount,
+        revenue = revenue - old.amount * old.price
+    WHERE day = date(old.sell_date) AND hour = strftime('%H', old.sell_date);
+    INSERT INTO hourly_sales_summary VALUES (
+        date(new.sell_date), strftime('%H', new.sell_date),
+        1, new.amount, new.amount * new.price
+    )
+    ON CONFLICT DO UPDATE SET
+        lines = lines + 1,
+        amount = amount + excluded.amount,
+        revenue = revenue + excluded.revenue;
+END;
+""",
+    """
+CREATE INDEX IF NOT EXISTS checks_sell_date ON checks(sell_date);
+""",
+    _integer_dates + _log_triggers + _fts_triggers + _summary_triggers,
+    """
+CREATE TABLE IF NOT EXISTS journals (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+) STRICT;
+""",
+    _checks_autoincrement + _log_triggers + _summary_triggers,
+]
+
+# trigram full-text search needs at least this many characters,
+# shorter text is searched by scanning
+_fts_min_length = 3
+
+_search_operators = {"<": "<", ">": ">", "=": "="}
+
+# how many row_changes entries survive pruning on shutdown;
+# views that fell further behind simply reload the whole table
+_changes_kept = 100000
+
 _exit_script = """
+DELETE FROM row_changes WHERE seq <= (SELECT MAX(seq) FROM row_changes) - %d;
 PRAGMA analysis_limit = 1000;
 PRAGMA optimize;
-"""
+""" % _changes_kept
 
 
-class Database:
-    _connection = None
+def _statements(script):
+    """the statements of script one at a time, for running it inside a
+    transaction, which executescript() would commit first"""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if _sql.complete_statement(statement):
+            yield statement
+            statement = ""
+
 
+def _migrate(cur):
+    # rebuilt tables are dropped while others still reference them,
+    # and the pragma has no effect inside a transaction
+    cur.execute("PRAGMA foreign_keys = 0")
+    version = 0
+    try:
+        while version < len(_migrations):
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # read under the write lock: tills opening an old database
+                # at once apply every step once, and only ever forward
+                version = cur.execute("PRAGMA user_version").fetchone()[0]
+                if version < len(_migrations):
+                    for statement in _statements(_migrations[version]):
+                        cur.execute(statement)
+                    version += 1
+                    cur.execute("PRAGMA user_version = %d" % version)
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.connection.rollback()
+                raise
+    finally:
+        cur.execute("PRAGMA foreign_keys = 1")
+
+
+def _new_codes(count, taken):
+    if count > _code_count - len(taken):
+        raise ValueError("Not enough free bonus codes")
+    codes = set()
+    while len(codes) < count:
+        code = _code_format % _rnd.randrange(_code_count)
+        if code not in taken:
+            codes.add(code)
+    return codes
+
+
+def _is_busy(error):
+    return (error.sqlite_errorcode & 0xFF) in (_sql.SQLITE_BUSY, _sql.SQLITE_LOCKED)
+
+
+def _retry_busy(method):
+    """retry a whole write transaction when another process holds the lock"""
+
+    @_ft.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # work pending in an outer transaction would be lost on rollback
+        retries = 0 if self._connection.in_transaction else _busy_retries - 1
+        for attempt in range(retries + 1):
+            try:
+                return method(self, *args, **kwargs)
+            except _sql.OperationalError as e:
+                if not _is_busy(e):
+                    raise
+                gave_up = attempt == retries
+                with _lock:
+                    _busy_counts["busy"] += 1
+                    _busy_counts["failed" if gave_up else "retries"] += 1
+                if gave_up:
+                    raise
+            _time.sleep(_busy_backoff * 2**attempt * (1 + _rnd.random()))
+
+    return wrapper
+
+
+def busy_stats(reset=False):
+    """a copy of the busy, retries and failed counts of this process"""
+    with _lock:
+        stats = dict(_busy_counts)
+        if reset:
+            _busy_counts.update(dict.fromkeys(_busy_counts, 0))
+    return stats
+
+
+def _day_range(start, end):
+    conditions, args = [], []
+    if start is not None:
+        conditions.append("day >= ?")
+        args.append(_dates.to_day(start))
+    if end is not None:
+        conditions.append("day <= ?")
+        args.append(_dates.to_day(end))
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), args
+
+
+_lock = _threading.Lock()
+_local = _threading.local()
+_schema_ready = set()
+_connections = []
+
+
+def connect(filename=_default_name):
+    """return the calling thread's connection to filename;
+    the first connection of the process also sets up the schema"""
+    own = _local.__dict__.setdefault("connections", {})
+    connection = own.get(filename)
+    if connection is not None:
+        return connection
+
+    connection = _sql.connect(
+        filename, timeout=_busy_timeout, check_same_thread=False
+    )
+    for pragma in _connection_pragmas:
+        connection.execute(pragma)
+    connection.create_function("casefold", 1, str.casefold, deterministic=True)
+    with _lock:
+        if filename not in _schema_ready:
+            cur = connection.cursor()
+            # a database at the latest version needs no setup at all
+            if cur.execute("PRAGMA user_version").fetchone()[0] < len(_migrations):
+                cur.executescript(_init_script)
+                _migrate(cur)
+            cur.close()
+            _schema_ready.add(filename)
+        _connections.append((filename, connection))
+    own[filename] = connection
+    return connection
+
+
+def disconnect(filename=_default_name):
+    """close the calling thread's connection to filename, if any"""
+    connection = _local.__dict__.get("connections", {}).pop(filename, None)
+    if connection is None:
+        return
+    with _lock:
+        # shutdown() may have closed it already
+        if (filename, connection) in _connections:
+            _connections.remove((filename, connection))
+    connection.close()
+
+
+def shutdown():
+    """optimize each database once and close every connection"""
+    with _lock:
+        optimized = set()
+        for filename, connection in _connections:
+            if filename not in optimized:
+                connection.executescript(_exit_script)
+                optimized.add(filename)
+            connection.close()
+        _connections.clear()
+        _schema_ready.clear()
+        _local.__dict__.clear()
+
+
+_atexit.register(shutdown)
+
+
+class Database:
     def close_connection():
-        Database._connection.close()
+        shutdown()
 
     def __init__(self, filename=_default_name):
-        if not Database._connection:
-            Database._connection = _sql.connect(filename)
+        # until connected, so that __del__ has nothing to close
+        self.closed = True
+        self._connection = connect(filename)
         self.closed = False
-        self._cur = Database._connection.cursor()
-        self._cur.executescript(_init_script)
+        self._raw_cur = self._cursor = self._connection.cursor()
+        self._stats = None
 
     def __del__(self):
         self.close()
 
+    @property
+    def _cur(self):
+        # follows querystats.enable() and disable() from any thread
+        stats = _querystats._stats
+        if stats is not self._stats:
+            self._stats = stats
+            self._cursor = (
+                self._raw_cur
+                if stats is None
+                else _querystats.TracedCursor(self._raw_cur, stats)
+            )
+        return self._cursor
+
     def save(self):
-        Database._connection.commit()
+        self._connection.commit()
+
+    def _begin(self):
+        """take the write lock up front, so that the busy timeout applies
+        instead of failing when a read transaction is upgraded to a write"""
+        if not self._connection.in_transaction:
+            self._cur.execute("BEGIN IMMEDIATE")
+
+    @_contextlib.contextmanager
+    def transaction(self):
+        """one write transaction, committed on exit or rolled back on error;
+        inside a transaction already open it joins that one"""
+        if self._connection.in_transaction:
+            yield self
+            return
+        self._begin()
+        with self._connection:
+            yield self
 
     def close(self):
         if self.closed:
             return
         self.closed = True
-        self._cur.executescript(_exit_script)
-        self._cur.close()
-        self.save()
+        try:
+            self.save()
+            self._cur.close()
+        except _sql.ProgrammingError:  # connection already shut down
+            pass
 
     def get_table(self, name):
         return self._cur.execute("SELECT * FROM %s" % name).fetchall()
 
+    def iter_query(self, query, args=(), size=_fetch_size):
+        """column names and an iterator over the rows of query, fetched size
+        rows at a time on a cursor of its own, so memory use stays flat"""
+        cur = self._connection.cursor()
+        stats = _querystats.current()
+        if stats is not None:
+            cur = _querystats.TracedCursor(cur, stats)
+        cur.execute(query, args)
+        columns = [column[0] for column in cur.description]
+
+        def rows():
+            try:
+                while chunk := cur.fetchmany(size):
+                    yield from chunk
+            finally:
+                cur.close()
+
+        return columns, rows()
+
+    def get_change_seq(self):
+        self._cur.execute("SELECT COALESCE(MAX(seq), 0) FROM row_changes")
+        return self._cur.fetchone()[0]
+
+    def get_changes(self, table, since, columns="t.*"):
+        """return (id, row) pairs for rows of table changed after change
+        number since, row being None for deleted rows and holding columns,
+        id first, otherwise; None if the log no longer reaches back that far"""
+        first = self._cur.execute("SELECT MIN(seq) FROM row_changes").fetchone()[0]
+        if first is not None and since < first - 1:
+            return None
+        self._cur.execute(
+            "SELECT c.row_id, %s FROM "
+            "(SELECT DISTINCT row_id FROM row_changes WHERE seq > ? AND tbl = ?) "
+            "AS c LEFT JOIN %s AS t ON t.id = c.row_id" % (columns, table),
+            (since, table),
+        )
+        return [
+            (row[0], row[1:] if row[1] is not None else None)
+            for row in self._cur.fetchall()
+        ]
+
+    def get_page(
+        self, table, order=None, after=None, before=None, limit=100, desc=False
+    ):
+        """keyset pagination over table sorted by (order, id), or by id when
+        order is None: the rows right after key after, or right before key
+        before, a key being the (order, id) values of a row or just its id.
+        Columns are compared as they are, so that their indexes serve the
+        page; NULL sorts before any value, as in SQLite"""
+        backward = before is not None
+        reverse = backward != desc
+        direction = "DESC" if reverse else "ASC"
+        operator = "<" if reverse else ">"
+        if order is None:
+            sort = "id %s" % direction
+        else:
+            sort = "%s %s, id %s" % (order, direction, direction)
+
+        query = "SELECT * FROM %s" % table
+        args = []
+        bound = before if backward else after
+        if bound is not None and order is None:
+            query += " WHERE id %s ?" % operator
+            args.append(bound)
+        elif bound is not None and bound[0] is None:
+            # among the NULLs, then every value when going up
+            query += " WHERE (%s IS NULL AND id %s ?)" % (order, operator)
+            if not reverse:
+                query += " OR %s IS NOT NULL" % order
+            args.append(bound[1])
+        elif bound is not None:
+            query += " WHERE (%s, id) %s (?, ?)" % (order, operator)
+            if reverse and self._nullable(table, order):
+                query += " OR %s IS NULL" % order
+            args += bound
+        query += " ORDER BY %s LIMIT ?" % sort
+        rows = self._cur.execute(query, args + [limit]).fetchall()
+        return rows[::-1] if backward else rows
+
+    def _nullable(self, table, column):
+        self._cur.execute(
+            'SELECT NOT "notnull" FROM pragma_table_info(?) WHERE name = ?',
+            (table, column),
+        )
+        return bool(self._cur.fetchone()[0])
+
+    def search_goods(self, name="", manufacturer="", **ranges):
+        """return ids of goods whose name and manufacturer contain the given
+        text, case-insensitively; ranges map the amount, sell_price and use_by
+        columns to (operator, value) pairs, the operator being <, > or ="""
+        conditions, args = [], []
+        for column, text in [("name", name), ("manufacturer", manufacturer)]:
+            if not text:
+                continue
+            if len(text) >= _fts_min_length:
+                conditions.append(
+                    "id IN (SELECT rowid FROM goods_fts WHERE goods_fts MATCH ?)"
+                )
+                args.append('%s: "%s"' % (column, text.replace('"', '""')))
+            else:
+                conditions.append("instr(casefold(%s), ?)" % column)
+                args.append(text.casefold())
+        for column, (operator, value) in ranges.items():
+            conditions.append("%s %s ?" % (column, _search_operators[operator]))
+            args.append(value)
+
+        query = "SELECT id FROM goods"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        self._cur.execute(query + " ORDER BY id", args)
+        return [row[0] for row in self._cur.fetchall()]
+
+    def get_daily_revenue(self, start=None, end=None):
+        """(day, checks, revenue, bonuses) for days between start and end
+        inclusive, either bound being a YYYY-MM-DD string or None"""
+        where, args = _day_range(start, end)
+        self._cur.execute(
+            "SELECT day, checks, revenue, bonuses FROM daily_check_summary%s "
+            "ORDER BY day" % where,
+            args,
+        )
+        return [(_dates.from_day(day), *row) for day, *row in self._cur.fetchall()]
+
+    def get_revenue(self, start=None, end=None):
+        where, args = _day_range(start, end)
+        self._cur.execute(
+            "SELECT COALESCE(SUM(revenue), 0) FROM daily_check_summary%s" % where, args
+        )
+        return self._cur.fetchone()[0]
+
+    def get_product_sales(self, start=None, end=None, product_id=None):
+        """(product_id, amount, revenue) per product sold between start and end,
+        revenue being at list prices, before bonuses are deducted"""
+        where, args = _day_range(start, end)
+        if product_id is not None:
+            where += " AND product_id = ?" if where else " WHERE product_id = ?"
+            args.append(product_id)
+        self._cur.execute(
+            "SELECT product_id, SUM(amount), SUM(revenue) FROM daily_sales_summary%s "
+            "GROUP BY product_id HAVING SUM(amount) != 0 ORDER BY product_id" % where,
+            args,
+        )
+        return self._cur.fetchall()
+
+    def get_check_sales(self, check_id):
+        self._cur.execute("SELECT id FROM sales WHERE check_id = ?", (check_id,))
+        return [row[0] for row in self._cur.fetchall()]
+
+    def get_checks_sales(self, check_ids):
+        self._cur.execute(
+            "SELECT id FROM sales WHERE check_id %s" % _ids,
+            (_json.dumps(list(check_ids)),),
+        )
+        return [row[0] for row in self._cur.fetchall()]
+
     def execute(self, *args):
         return self._cur.execute(*args)
 
+    def executemany(self, *args):
+        return self._cur.executemany(*args)
+
     def get_columns(self, table):
         self._cur.execute("SELECT name FROM PRAGMA_TABLE_INFO('%s')" % table)
         return [name[0] for name in self._cur.fetchall()]
 
+    def get_indexed_columns(self, table):
+        """columns that lead an index of table: ordering by them reads the
+        index instead of sorting the whole table"""
+        self._cur.execute(
+            "SELECT i.name FROM PRAGMA_INDEX_LIST(?) AS l, "
+            "PRAGMA_INDEX_INFO(l.name) AS i WHERE i.seqno = 0",
+            (table,),
+        )
+        return {name[0] for name in self._cur.fetchall()}
+
     def get_user(self, login):
         self._cur.execute("SELECT password, role FROM logins WHERE login = ?", (login,))
         result = self._cur.fetchone()
@@ -114,17 +984,22 @@ class Database:
         self._cur.execute(
             "INSERT INTO logins VALUES (?, ?, ?)", (login, password, role)
         )
+        self.save()
 
     def get_new_check_id(self):
-        result = self._cur.execute("SELECT MAX(id)+1 FROM checks").fetchone()[0]
-        return 1 if not result else result
+        result = self._cur.execute(
+            "SELECT seq + 1 FROM sqlite_sequence WHERE name = 'checks'"
+        ).fetchone()
+        return 1 if result is None else result[0]
 
     def add_check(self, id_, sum_, bonuses, client):
         if bonuses is None:
             bonuses = 0
         sum_ -= bonuses * 10
         self._cur.execute(
-            "INSERT INTO checks VALUES (?, ?, ?, ?)", (id_, sum_, bonuses, client)
+            "INSERT INTO checks (id, sum, bonuses, client_id, sell_date) "
+            "VALUES (?, ?, ?, ?, %s)" % _now,
+            (id_, sum_, bonuses, client),
         )
 
     def change_by_amount(self, id_, amount):
@@ -136,14 +1011,98 @@ class Database:
         new = current[0] + amount
         self._cur.execute("UPDATE goods SET amount = ? WHERE id = ?", (new, id_))
 
+    def upsert_goods(self, records):
+        """apply delivery records, dicts of goods columns plus an action:
+        "insert" adds a new product, "add" adds the amount to an existing one,
+        "update" replaces its data, keeping the columns whose value is None"""
+        self._cur.executemany(_upsert_goods, records)
+
     def sell_product(self, check_id, product_id, amount):
         self.change_by_amount(product_id, -amount)
 
         self._cur.execute(
-            "INSERT INTO sales VALUES (NULL, ?, ?, ?, date())",
-            (check_id, product_id, amount),
+            "INSERT INTO sales (check_id, product_id, amount, sell_date, price) "
+            "SELECT ?, id, ?, %s, sell_price FROM goods WHERE id = ?" % _now,
+            (check_id, amount, product_id),
         )
 
+    @_retry_busy
+    def sell_check(
+        self, check_id, lines, client_id=None, use_bonuses=0, sell_date=None
+    ):
+        """lines is a list of (product_id, amount) pairs, check_id may be None
+        to number the check when it is committed, sell_date None for now;
+        returns the check id, its final sum and the bonuses accrued to the client"""
+        use_bonuses = use_bonuses or 0
+        amounts = {}
+        for product_id, amount in lines:
+            amounts[product_id] = amounts.get(product_id, 0) + amount
+
+        with self.transaction():
+            self._cur.execute(
+                "SELECT id, sell_price, bonuses FROM goods WHERE id IN (%s)"
+                % ", ".join("?" * len(amounts)),
+                tuple(amounts),
+            )
+            prices = {id_: (price, bonuses) for id_, price, bonuses in self._cur}
+            sum_ = sum(prices[id_][0] * amount for id_, amount in lines)
+            add_bonuses = sum(prices[id_][1] for id_, _ in lines)
+            sum_ -= use_bonuses * 10
+
+            check_id, sell_date = self._cur.execute(
+                "INSERT INTO checks (id, sum, bonuses, client_id, sell_date) "
+                "VALUES (?, ?, ?, ?, COALESCE(?, %s)) RETURNING id, sell_date" % _now,
+                (check_id, sum_, use_bonuses, client_id, sell_date),
+            ).fetchone()
+            self._cur.executemany(
+                "INSERT INTO sales (check_id, product_id, amount, sell_date, price) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (check_id, product_id, amount, sell_date, prices[product_id][0])
+                    for product_id, amount in lines
+                ],
+            )
+            self._cur.executemany(
+                "UPDATE goods SET amount = amount - ? WHERE id = ?",
+                [(amount, id_) for id_, amount in amounts.items()],
+            )
+            if client_id is not None:
+                self.change_bonuses(client_id, add_bonuses - use_bonuses)
+        return check_id, sum_, add_bonuses
+
+    @_retry_busy
+    def sell_checks(self, checks, journal=None, seq=None):
+        """sell many checks in one transaction; checks are (lines, client_id,
+        use_bonuses, sell_date) tuples as taken by sell_check. A check that
+        fails is rolled back alone and its result is the exception instead.
+        With a journal name, seq is stored as the last of its entries applied"""
+        results = []
+        with self.transaction():
+            for lines, client_id, use_bonuses, sell_date in checks:
+                self._cur.execute("SAVEPOINT sell_checks")
+                try:
+                    results.append(
+                        self.sell_check(None, lines, client_id, use_bonuses, sell_date)
+                    )
+                except (_sql.IntegrityError, KeyError) as e:
+                    # a missing product or bonuses spent twice
+                    self._cur.execute("ROLLBACK TO sell_checks")
+                    results.append(e)
+                self._cur.execute("RELEASE sell_checks")
+            if journal is not None:
+                self._cur.execute(
+                    "INSERT INTO journals VALUES (?, ?) "
+                    "ON CONFLICT DO UPDATE SET seq = excluded.seq",
+                    (journal, seq),
+                )
+        return results
+
+    def get_journal_seq(self, journal):
+        """the last entry of journal applied by sell_checks, 0 if none"""
+        self._cur.execute("SELECT seq FROM journals WHERE name = ?", (journal,))
+        result = self._cur.fetchone()
+        return result[0] if result else 0
+
     def return_check(self, check_id):
         self._cur.execute("DELETE FROM checks WHERE id = ?", (check_id,))
         self._cur.execute("DELETE FROM sales WHERE check_id = ?", (check_id,))
@@ -179,21 +1138,56 @@ class Database:
         )
         self._cur.execute("DELETE FROM sales WHERE id = ?", (id_,))
 
+    @_retry_busy
+    def return_sales(self, sale_ids):
+        """return many sales at once: returnable goods go back to stock and
+        each check loses the cost of its sales at the price they were sold at;
+        returns the number of sales removed"""
+        ids = (_json.dumps(list(sale_ids)),)
+        with self.transaction():
+            self._cur.execute(_restock_sales % "id", ids)
+            self._cur.execute(_reduce_checks, ids)
+            self._cur.execute("DELETE FROM sales WHERE id %s" % _ids, ids)
+            return self._cur.rowcount
+
+    @_retry_busy
+    def return_checks(self, check_ids):
+        """return whole checks: their returnable goods go back to stock and
+        the checks are removed with their sales; returns the number of checks"""
+        ids = (_json.dumps(list(check_ids)),)
+        with self.transaction():
+            self._cur.execute(_restock_sales % "check_id", ids)
+            self._cur.execute("DELETE FROM sales WHERE check_id %s" % _ids, ids)
+            self._cur.execute("DELETE FROM checks WHERE id %s" % _ids, ids)
+            return self._cur.rowcount
+
+    @_retry_busy
     def generate_codes(self):
-        self._cur.execute("SELECT id, bonus_code, code_date FROM clients")
-        results = [list(row) for row in self._cur.fetchall()]
-        today = _dt.date.today()
-        for row in results:
-            date = _dates.to_date(row[2])
-            if not date or date < today:
-                row[1] = str(_rnd.randint(1000000, 1999999))[1:]
-                row[2] = _dates.from_date(today)
-            self._cur.execute(
+        """give a new unique bonus code to every client whose code has expired"""
+        today = _dates.today()
+        with self.transaction():
+            self._cur.execute("SELECT id FROM clients WHERE code_date < ?", (today,))
+            expired = [row[0] for row in self._cur.fetchall()]
+            if not expired:
+                return 0
+            self._cur.execute("SELECT bonus_code FROM clients")
+            taken = {row[0] for row in self._cur.fetchall()}
+            codes = _new_codes(len(expired), taken)
+            self._cur.executemany(
                 "UPDATE clients SET bonus_code = ?, code_date = ? WHERE id = ?",
-                (row[1], row[2], row[0]),
+                [(code, today, id_) for id_, code in zip(expired, codes)],
             )
-        print("Codes:", results)
-        self.save()
+        return len(expired)
+
+    @_retry_busy
+    def reset_sales(self):
+        """remove all checks and sales together with their summaries"""
+        with self.transaction():
+            self._cur.execute("DELETE FROM sales")
+            self._cur.execute("DELETE FROM checks")
+            # the delete triggers leave the summary rows at zero
+            for table in _summary_tables:
+                self._cur.execute("DELETE FROM %s" % table)
 
     def get_client_by_code(self, code):
         self._cur.execute(
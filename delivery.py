@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""bulk delivery import: a CSV with a header row is read in chunks, checked
+and applied to goods in one transaction; bad rows are reported and skipped.
+Run as `python delivery.py FILE [DATABASE]`"""
+import csv as _csv
+import itertools as _it
+import sys
+
+import dates as _dates
+
+__all__ = ["ACTIONS", "COLUMNS", "read_csv", "import_rows", "import_csv"]
+
+ACTIONS = ["insert", "add", "update"]
+
+# barcode is the goods id; action is optional, a new barcode is inserted
+# and a known one gets the amount added
+COLUMNS = [
+    "barcode",
+    "name",
+    "manufacturer",
+    "amount",
+    "sell_price",
+    "use_by",
+    "purchase_price",
+    "bonuses",
+    "action",
+]
+
+_chunk_size = 5000
+
+_numbers = ["amount", "sell_price", "purchase_price", "bonuses"]
+
+
+def read_csv(f):
+    """(line number, row dict) for every data line of an open CSV file"""
+    reader = _csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(_it.islice(rows, size)):
+        yield chunk
+
+
+def _number(text):
+    return int(text) if text.isdigit() else False
+
+
+def _parse_chunk(chunk):
+    """records for Database.upsert_goods or error messages, one per row of
+    chunk; each check runs down a whole column before the next, and the
+    first one a row fails is its error"""
+    columns = {k: [(row.get(k) or "").strip() for _, row in chunk] for k in COLUMNS}
+    errors = [None] * len(chunk)
+
+    def fail(failed):
+        for i, message in failed:
+            if errors[i] is None:
+                errors[i] = message
+
+    barcodes = columns["barcode"]
+    fail(
+        (i, "штрихкод должен состоять из 13 цифр")
+        for i, text in enumerate(barcodes)
+        if len(text) != 13 or not text.isdigit()
+    )
+    actions = [text.lower() for text in columns["action"]]
+    fail(
+        (i, "неизвестное действие %s" % columns["action"][i])
+        for i, action in enumerate(actions)
+        if action and action not in ACTIONS
+    )
+    fail(
+        (i, "не указано количество")
+        for i, text in enumerate(columns["amount"])
+        if not text
+    )
+    numbers = {}
+    for column in _numbers:
+        values = numbers[column] = [
+            _number(text) if text else None for text in columns[column]
+        ]
+        fail(
+            (i, "%s должно быть целым неотрицательным числом" % column)
+            for i, value in enumerate(values)
+            if value is False
+        )
+    # a delivery carries few distinct dates, to_day parses each once
+    use_by = _dates.to_days(columns["use_by"])
+    fail(
+        (i, "неверная дата %s" % text)
+        for i, (text, day) in enumerate(zip(columns["use_by"], use_by))
+        if text and day is None
+    )
+
+    results = []
+    for i, error in enumerate(errors):
+        if error is not None:
+            results.append(error)
+            continue
+        record = {"id": int(barcodes[i]), "action": actions[i]}
+        for column in _numbers:
+            record[column] = numbers[column][i]
+        record["use_by"] = use_by[i]
+        record["name"] = columns["name"][i] or None
+        record["manufacturer"] = columns["manufacturer"][i] or None
+        results.append(record)
+    return results
+
+
+def _check_chunk(db, chunk, names):
+    """parse a chunk and check it against goods;
+    names maps the product names seen so far to their ids"""
+    parsed = list(zip([line for line, _ in chunk], _parse_chunk(chunk)))
+    records = [r for _, r in parsed if isinstance(r, dict)]
+    existing = set()
+    if records:
+        ids = [r["id"] for r in records]
+        existing.update(
+            row[0]
+            for row in db.execute(
+                "SELECT id FROM goods WHERE id IN (%s)" % ", ".join("?" * len(ids)),
+                ids,
+            )
+        )
+        new_names = [
+            r["name"] for r in records if r["name"] and r["name"] not in names
+        ]
+        if new_names:
+            names.update(
+                db.execute(
+                    "SELECT name, id FROM goods WHERE name IN (%s)"
+                    % ", ".join("?" * len(new_names)),
+                    new_names,
+                ).fetchall()
+            )
+
+    good, errors = [], []
+    for line, record in parsed:
+        if isinstance(record, dict):
+            record = _resolve(record, existing, names)
+        if isinstance(record, dict):
+            good.append(record)
+        else:
+            errors.append((line, record))
+    return good, errors
+
+
+def _resolve(record, existing, names):
+    """check one record against the rows known so far and mark it applied"""
+    id_, action, name = record["id"], record["action"], record["name"]
+    known = id_ in existing
+    if not action:
+        action = record["action"] = "add" if known else "insert"
+    if action == "insert" and known:
+        return "товар со штрихкодом %d уже есть" % id_
+    if action != "insert" and not known:
+        return "товара со штрихкодом %d нет" % id_
+    if action != "add":
+        if not name or not record["manufacturer"] or record["sell_price"] is None:
+            return "нужны наименование, производитель и цена"
+        if names.get(name, id_) != id_:
+            return "наименование %s уже занято" % name
+
+    existing.add(id_)
+    if action != "add":
+        names[name] = id_
+    return record
+
+
+def import_rows(db, rows, chunk_size=_chunk_size):
+    """apply (line number, row dict) pairs in one transaction;
+    returns the number of rows applied and (line number, error) pairs"""
+    count, errors, names = 0, [], {}
+    with db.transaction():
+        for chunk in _chunks(rows, chunk_size):
+            records, chunk_errors = _check_chunk(db, chunk, names)
+            db.upsert_goods(records)
+            count += len(records)
+            errors += chunk_errors
+    return count, errors
+
+
+def import_csv(db, filename, chunk_size=_chunk_size):
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        return import_rows(db, read_csv(f), chunk_size)
+
+
+if __name__ == "__main__":
+    from db_sqlite import Database
+
+    if len(sys.argv) not in (2, 3):
+        raise SystemExit(__doc__)
+    count, errors = import_csv(Database(*sys.argv[2:]), sys.argv[1])
+    for line, error in errors:
+        print("%d: %s" % (line, error), file=sys.stderr)
+    print("imported %d rows, %d errors" % (count, len(errors)))
+    if errors:
+        raise SystemExit(1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""streaming export of checks, sales and goods to CSV or JSON Lines,
+gzipped when the file name ends in .gz"""
+import argparse as _argparse
+import csv as _csv
+import gzip as _gzip
+import json as _json
+
+import dates as _dates
+
+__all__ = ["TABLES", "FORMATS", "export", "export_file"]
+
+# table name: query, with a %s for the date filter
+# and {checks} and {sales} for the tables read
+# dates are written as text in UTC
+TABLES = {
+    "checks": "SELECT id, sum, bonuses, client_id, "
+    "datetime(sell_date, 'unixepoch') AS sell_date FROM {checks}%s ORDER BY id",
+    "sales": "SELECT s.id, s.check_id, s.product_id, g.name, g.manufacturer, "
+    "s.amount, s.price, s.amount * s.price AS cost, "
+    "datetime(s.sell_date, 'unixepoch') AS sell_date "
+    "FROM {sales} AS s LEFT JOIN goods AS g ON g.id = s.product_id%s "
+    "ORDER BY s.id",
+    "goods": "SELECT id, name, manufacturer, amount, sell_price, "
+    "date(use_by * 86400, 'unixepoch') AS use_by, purchase_price, bonuses, "
+    "returnable FROM goods ORDER BY id",
+}
+
+FORMATS = ["csv", "jsonl"]
+
+_live = {"checks": "checks", "sales": "sales"}
+# views over the live tables and every archive, see archive.Archive
+_archived = {"checks": "all_checks", "sales": "all_sales"}
+
+
+def _where(table, start, end):
+    """date filter for the query of table, start and end being YYYY-MM-DD
+    strings; goods have no date to filter by"""
+    column = "s.sell_date" if table == "sales" else "sell_date"
+    conditions, args = [], []
+    if start is not None:
+        conditions.append("%s >= ?" % column)
+        args.append(_dates.day_start(_dates.to_day(start)))
+    if end is not None:
+        conditions.append("%s < ?" % column)
+        args.append(_dates.day_start(_dates.to_day(end) + 1))
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), args
+
+
+def _rows(db, table, start=None, end=None, archived=False):
+    if archived and table in _archived:
+        import archive
+
+        archive.Archive(db).attach_all()
+    query = TABLES[table].format(**_archived if archived else _live)
+    args = []
+    if "%s" in query:
+        where, args = _where(table, start, end)
+        query %= where
+    return db.iter_query(query, args)
+
+
+def _write_csv(f, columns, rows):
+    writer = _csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_jsonl(f, columns, rows):
+    count = 0
+    for row in rows:
+        f.write(_json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        f.write("\n")
+        count += 1
+    return count
+
+
+_writers = {"csv": _write_csv, "jsonl": _write_jsonl}
+
+
+def _format(filename):
+    name = filename[:-3] if filename.endswith(".gz") else filename
+    return "jsonl" if name.endswith((".jsonl", ".json")) else "csv"
+
+
+def export(db, table, f, format_="csv", start=None, end=None, archived=False):
+    """write table to the open text file f, checks and sales limited to
+    days between start and end inclusive and read from the archives too
+    when archived is set; returns the number of rows"""
+    columns, rows = _rows(db, table, start, end, archived)
+    return _writers[format_](f, columns, rows)
+
+
+def export_file(
+    db, table, filename, format_=None, start=None, end=None, archived=False
+):
+    """export to filename, the format defaulting to its extension"""
+    format_ = format_ or _format(filename)
+    open_ = _gzip.open if filename.endswith(".gz") else open
+    with open_(filename, "wt", newline="", encoding="utf-8") as f:
+        return export(db, table, f, format_, start, end, archived)
+
+
+def _date_arg(text):
+    if _dates.to_day(text) is None:
+        raise _argparse.ArgumentTypeError("not a YYYY-MM-DD date: %s" % text)
+    return text
+
+
+def main(args=None):
+    from db_sqlite import Database
+
+    parser = _argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--start", type=_date_arg, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=_date_arg, help="last day, YYYY-MM-DD")
+    parser.add_argument("--database")
+    parser.add_argument(
+        "--archived", action="store_true", help="include archived checks and sales"
+    )
+    args = parser.parse_args(args)
+
+    db = Database(*[args.database] if args.database else [])
+    count = export_file(
+        db,
+        args.table,
+        args.file,
+        args.format,
+        args.start,
+        args.end,
+        args.archived,
+    )
+    print("exported %d rows" % count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from repository import Product, Repository
+
+__all__ = ["Product", "GoodsIndex"]
+
+
+class GoodsIndex:
+    """goods by id and by name, refreshed from the database change log;
+    the barcode doubles as the id, so it needs no index of its own"""
+
+    def __init__(self, db=None, worker=None):
+        self.db = db
+        self.worker = worker
+        self._by_id = {}
+        self._by_name = {}
+        self._seq = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def update(self):
+        if self.worker is None:
+            self.apply_changes(self.fetch_changes(self.db, self._seq))
+        else:
+            self.worker.submit(
+                self.fetch_changes, self._seq, on_done=self.apply_changes
+            )
+
+    def fetch_changes(self, db, since):
+        """see TableView.fetch_changes; the products are made on the worker"""
+        repository = Repository(db)
+        seq = db.get_change_seq()
+        changes = None if since is None else repository.goods_changes(since)
+        goods = repository.goods() if changes is None else None
+        return seq, changes, goods
+
+    def apply_changes(self, result):
+        seq, changes, goods = result
+        if changes is None:
+            self.load(goods)
+        else:
+            for id_, product in changes:
+                self.set(id_, product)
+        self._seq = seq
+
+    def load(self, goods):
+        self._by_id.clear()
+        self._by_name.clear()
+        for product in goods:
+            self.set(product.id, product)
+
+    def set(self, id_, product):
+        """product is a Product, or None for a deleted one"""
+        old = self._by_id.pop(id_, None)
+        if old is not None:
+            self._by_name.pop(old.name, None)
+        if product is not None:
+            self._by_id[id_] = self._by_name[product.name] = product
+
+    def get(self, id_):
+        return self._by_id.get(id_)
+
+    def find(self, name):
+        return self._by_name.get(name)
+
+    def change_amount(self, id_, amount):
+        product = self._by_id[id_]
+        product.amount += amount
+        return product
@@ -0,0 +1,292 @@
+"""group commit of sold checks: each check is appended to a journal file and
+acknowledged at once, and a writer thread sells the journaled checks in one
+transaction every interval or every batch checks, whichever comes first.
+
+The journal is as durable as the database with synchronous = NORMAL: it is
+flushed to the operating system on every check, and also synced to disk
+with sync set. Entries committed so far are recorded in the journals table
+in the same transaction as the checks, so after a crash the entries past it
+are replayed when the journal is opened again. Replayed checks that fail,
+and the checks failed at the till when a database error stops the writer,
+are kept in a rejects file next to it.
+
+Every till has a journal of its own, named after COFFEE_TILL or the host,
+and holds a lock on it while running: a second process on the same journal
+fails at once instead of selling its checks twice.
+
+Enabled in Cashier by COFFEE_GROUP_COMMIT set to the interval in
+milliseconds"""
+import atexit as _atexit
+import concurrent.futures as _futures
+import json as _json
+import os as _os
+import os.path as _path
+import re as _re
+import socket as _socket
+import sqlite3 as _sql
+import threading as _threading
+import time as _time
+
+import db_sqlite as _db
+
+try:
+    import fcntl as _fcntl
+except ImportError:  # Windows
+    _fcntl = None
+    import msvcrt as _msvcrt
+
+__all__ = ["GroupCommit", "current", "start", "start_from_env", "stop"]
+
+# seconds between commits and checks per commit at most
+_interval = 0.05
+_batch_size = 100
+
+_env_var = "COFFEE_GROUP_COMMIT"
+# the name of this till, the host name if unset
+_till_env_var = "COFFEE_TILL"
+
+_group = None
+
+
+def _journal_name(filename, till):
+    # the till name ends up in a file name
+    till = _re.sub(r"[^\w.-]", "_", till)
+    return "%s-sales-%s.jsonl" % (_path.splitext(filename)[0], till)
+
+
+def _rejects_name(journal):
+    return _path.splitext(journal)[0] + "-rejects.jsonl"
+
+
+def _lock_file(file):
+    """lock file for this process alone; False if another one holds it"""
+    try:
+        if _fcntl is not None:
+            _fcntl.flock(file.fileno(), _fcntl.LOCK_EX | _fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            _msvcrt.locking(file.fileno(), _msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _read_journal(file):
+    """entries of the journal file in order; a line cut short by a crash
+    ends it"""
+    entries = []
+    file.seek(0)
+    for line in file:
+        try:
+            entries.append(_json.loads(line))
+        except ValueError:
+            break
+    return entries
+
+
+def _check(entry):
+    return entry["lines"], entry["client_id"], entry["use_bonuses"], entry["time"]
+
+
+class GroupCommit:
+    """sells checks into the database filename through the journal file
+    journal, by default the one named after the database and till, the host
+    name if None. Raises RuntimeError if another process holds the journal"""
+
+    def __init__(
+        self,
+        filename=_db._default_name,
+        journal=None,
+        till=None,
+        interval=_interval,
+        batch=_batch_size,
+        sync=False,
+    ):
+        self.filename = filename
+        self.journal = journal or _journal_name(
+            filename, till or _socket.gethostname()
+        )
+        self.interval = interval
+        self.batch = batch
+        self.sync = sync
+        self._name = _path.basename(self.journal)
+        self._lock = _threading.Lock()
+        self._ready = _threading.Condition(self._lock)
+        # (entry, future) pairs journaled but not committed yet
+        self._pending = []
+        self._seq = 0
+        self._closed = False
+        # the database error that stopped the writer
+        self.error = None
+        # a+ keeps every write at the end while the lock is held
+        self._file = open(self.journal, "a+", encoding="utf-8")
+        if not _lock_file(self._file):
+            self._file.close()
+            raise RuntimeError("journal %s is used by another till" % self.journal)
+        try:
+            self.replayed, self.rejected = self._replay()
+        except BaseException:
+            self._file.close()
+            raise
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        """sell the checks journaled before a crash; returns the numbers of
+        checks replayed and of those that failed and went to the rejects"""
+        db = _db.Database(self.filename)
+        applied = db.get_journal_seq(self._name)
+        entries = [e for e in _read_journal(self._file) if e["seq"] > applied]
+        self._seq = max([applied] + [e["seq"] for e in entries])
+        rejects = []
+        if entries:
+            results = db.sell_checks(
+                list(map(_check, entries)), self._name, self._seq
+            )
+            rejects = [
+                (entry, result)
+                for entry, result in zip(entries, results)
+                if isinstance(result, Exception)
+            ]
+        db.close()
+        if rejects:
+            self._reject(rejects)
+        # nothing in it is left to apply
+        self._file.truncate(0)
+        return len(entries), len(rejects)
+
+    def _reject(self, rejects):
+        """append (entry, error) pairs to the rejects file, synced to disk"""
+        with open(_rejects_name(self.journal), "a", encoding="utf-8") as f:
+            for entry, error in rejects:
+                f.write(_json.dumps(dict(entry, error=repr(error))) + "\n")
+            f.flush()
+            _os.fsync(f.fileno())
+
+    def submit(self, lines, client_id=None, use_bonuses=0):
+        """journal a check and return a future of what Database.sell_check
+        returns for it, set once the check is committed"""
+        future = _futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("group commit is stopped: %s" % self.error)
+            self._seq += 1
+            entry = {
+                "seq": self._seq,
+                "lines": [list(line) for line in lines],
+                "client_id": client_id,
+                "use_bonuses": use_bonuses or 0,
+                "time": int(_time.time()),
+            }
+            self._file.write(_json.dumps(entry) + "\n")
+            self._file.flush()
+            if self.sync:
+                _os.fsync(self._file.fileno())
+            self._pending.append((entry, future))
+            # the writer waits for the first check, then for a full batch
+            if len(self._pending) in (1, self.batch):
+                self._ready.notify()
+        return future
+
+    def sell_check(self, lines, client_id=None, use_bonuses=0):
+        """submit() and wait for the commit"""
+        return self.submit(lines, client_id, use_bonuses).result()
+
+    def _take(self):
+        with self._lock:
+            while not self._pending and not self._closed:
+                self._ready.wait()
+            # the first check waits interval at most for others to join it
+            self._ready.wait_for(
+                lambda: len(self._pending) >= self.batch or self._closed,
+                self.interval,
+            )
+            batch = self._pending[: self.batch]
+            del self._pending[: self.batch]
+            return batch
+
+    def _run(self):
+        db = _db.Database(self.filename)
+        while self.error is None:
+            batch = self._take()
+            if not batch:
+                break
+            self._commit(db, batch)
+        db.close()
+
+    def _commit(self, db, batch):
+        try:
+            results = db.sell_checks(
+                [_check(entry) for entry, _ in batch],
+                self._name,
+                batch[-1][0]["seq"],
+            )
+        except Exception as e:
+            if isinstance(e, _sql.OperationalError) and _db._is_busy(e):
+                # journaled checks are sold already, they wait for the lock
+                with self._lock:
+                    self._pending[:0] = batch
+                _time.sleep(self.interval)
+                return
+            # the checks from this batch on fail at the till, which sells
+            # them again; they go to the rejects instead of being replayed
+            with self._lock:
+                self.error = e
+                self._closed = True
+                batch += self._pending
+                self._pending.clear()
+                self._reject([(entry, e) for entry, _ in batch])
+                self._file.truncate(0)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            if not self._pending:
+                self._file.truncate(0)
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """commit the checks journaled so far and stop"""
+        with self._lock:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join()
+        # releases the lock too
+        self._file.close()
+
+
+def current():
+    """the group commit Cashier sells through, None while disabled or once
+    a database error has stopped it"""
+    if _group is None or _group.error is not None:
+        return None
+    return _group
+
+
+def start(filename=_db._default_name, interval=_interval, **kwargs):
+    """start the process-wide group commit, if it is not running yet"""
+    global _group
+    if _group is None:
+        _group = GroupCommit(filename, interval=interval, **kwargs)
+        _atexit.register(stop)
+    return _group
+
+
+def start_from_env(filename=_db._default_name):
+    """start() with the interval and till given by the environment, if any"""
+    interval = _os.environ.get(_env_var)
+    if interval:
+        start(filename, float(interval) / 1000, till=_os.environ.get(_till_env_var))
+    return _group
+
+
+def stop():
+    global _group
+    if _group is not None:
+        _group.close()
+        _group = None
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""multi-terminal load simulator: several processes work a copy of the
+database the way Cashier does, browsing goods, selling checks, some with
+bonuses, and now and then returning a sale; reports checks/s, latency
+percentiles per operation and locked-database counts.
+Run as `python loadsim.py [--database FILE] [--terminals 1,2,4,8]
+[--duration SECONDS] [--think SECONDS] [--sales N]`"""
+import argparse as _argparse
+import multiprocessing as _mp
+import os.path as _path
+import random as _rnd
+import sqlite3 as _sql
+import statistics as _stats
+import tempfile as _tmp
+import time as _time
+
+import db_sqlite
+from db_sqlite import Database
+from goods_index import GoodsIndex
+
+__all__ = ["simulate", "copy_database"]
+
+# chances per check of paying with bonuses and of returning a sale after it
+_bonus_share = 0.3
+_return_share = 0.05
+_max_lines = 8
+_search_length = 4
+# mean seconds a cashier spends between checks, none by default
+_think_time = 0.0
+
+_operations = ["browse", "search", "client", "sell", "return"]
+
+
+def copy_database(source, target):
+    """copy source into target with the backup API, which is safe while other
+    connections write to source, and restock every product so that the
+    simulation never runs out of goods"""
+    src = _sql.connect("file:%s?mode=ro" % source, uri=True)
+    dst = _sql.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.execute("UPDATE goods SET amount = 1000000000")
+    dst.commit()
+    dst.close()
+
+
+class _Terminal:
+    """one cashier: latencies of every operation in seconds, checks sold
+    and errors that reached the cashier"""
+
+    def __init__(self, filename, seed):
+        self.db = Database(filename)
+        self.rnd = _rnd.Random(seed)
+        self.index = GoodsIndex(self.db)
+        self.codes = [
+            row[0] for row in self.db.execute("SELECT bonus_code FROM clients")
+        ]
+        self.checks = []
+        self.latency = {name: [] for name in _operations}
+        self.sold = 0
+        self.errors = 0
+
+    def timed(self, name, func, *args):
+        start = _time.perf_counter()
+        try:
+            result = func(*args)
+        except (_sql.OperationalError, _sql.IntegrityError) as e:
+            # an integrity error is a lost race, such as two tills spending
+            # the bonuses of one client
+            if isinstance(e, _sql.OperationalError) and not db_sqlite._is_busy(e):
+                raise
+            if self.db._connection.in_transaction:
+                self.db._connection.rollback()
+            self.errors += 1
+            return None
+        self.latency[name].append(_time.perf_counter() - start)
+        return result
+
+    def sell_one(self):
+        self.timed("browse", self.index.update)
+        products = [p for p in self.index if p.amount > 0]
+        product = self.rnd.choice(products)
+        self.timed("search", self.db.search_goods, product.name[:_search_length])
+
+        lines = [
+            (self.rnd.choice(products).id, self.rnd.randint(1, 3))
+            for _ in range(self.rnd.randint(1, _max_lines))
+        ]
+        client_id, use_bonuses = None, 0
+        if self.codes and self.rnd.random() < _bonus_share:
+            client = self.timed(
+                "client", self.db.get_client_by_code, self.rnd.choice(self.codes)
+            )
+            if client is not None:
+                client_id, bonuses = client
+                total = sum(self.index.get(id_).sell_price * n for id_, n in lines)
+                use_bonuses = min(bonuses, total // 10)
+
+        result = self.timed(
+            "sell", self.db.sell_check, None, lines, client_id, use_bonuses
+        )
+        if result is not None:
+            self.checks.append(result[0])
+            self.sold += 1
+
+        if self.checks and self.rnd.random() < _return_share:
+            self.timed("return", self.return_sale, self.rnd.choice(self.checks))
+
+    def return_sale(self, check_id):
+        # what Cashier does for one selected sale
+        sale_ids = self.db.get_check_sales(check_id)
+        if sale_ids:
+            self.db.return_sales([self.rnd.choice(sale_ids)])
+
+    def run(self, until, think_time=_think_time):
+        while _time.monotonic() < until:
+            self.sell_one()
+            if think_time:
+                _time.sleep(self.rnd.expovariate(1 / think_time))
+
+
+def _terminal(filename, seed, barrier, duration, think_time, results):
+    terminal = _Terminal(filename, seed)
+    db_sqlite.busy_stats(reset=True)
+    barrier.wait()
+    terminal.run(_time.monotonic() + duration, think_time)
+    results.put(
+        (terminal.latency, terminal.sold, terminal.errors, db_sqlite.busy_stats())
+    )
+    terminal.db.close()
+
+
+def _percentiles(values):
+    if len(values) < 2:
+        return [values[0] if values else 0.0] * 3
+    cuts = _stats.quantiles(values, n=100, method="inclusive")
+    return [cuts[49], cuts[94], cuts[98]]
+
+
+def simulate(filename, terminals, duration, think_time=_think_time, seed=0):
+    """run terminals processes on filename for duration seconds;
+    returns checks sold, errors, merged latencies and busy counts"""
+    ctx = _mp.get_context("spawn")
+    barrier = ctx.Barrier(terminals)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_terminal,
+            args=(filename, seed + i, barrier, duration, think_time, results),
+        )
+        for i in range(terminals)
+    ]
+    for p in processes:
+        p.start()
+
+    latency = {name: [] for name in _operations}
+    sold = errors = 0
+    busy = dict.fromkeys(db_sqlite.busy_stats(), 0)
+    for _ in processes:
+        times, terminal_sold, terminal_errors, terminal_busy = results.get()
+        for name, values in times.items():
+            latency[name] += values
+        sold += terminal_sold
+        errors += terminal_errors
+        for key, count in terminal_busy.items():
+            busy[key] += count
+    for p in processes:
+        p.join()
+    if any(p.exitcode for p in processes):
+        raise SystemExit("a terminal failed")
+    return sold, errors, latency, busy
+
+
+def report(terminals, duration, sold, errors, latency, busy):
+    print(
+        "%d terminals: %.0f checks/s, %d errors, busy %d, retries %d, failed %d"
+        % (
+            terminals,
+            sold / duration,
+            errors,
+            busy["busy"],
+            busy["retries"],
+            busy["failed"],
+        )
+    )
+    for name in _operations:
+        values = latency[name]
+        if values:
+            p50, p95, p99 = (t * 1000 for t in _percentiles(values))
+            print(
+                "  %-8s %7d  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms"
+                % (name, len(values), p50, p95, p99)
+            )
+
+
+def main(args=None):
+    parser = _argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument("--database", help="database to copy, synthetic if absent")
+    parser.add_argument("--terminals", default="1,2,4,8")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--think", type=float, default=_think_time)
+    parser.add_argument("--sales", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    with _tmp.TemporaryDirectory() as tmp:
+        filename = _path.join(tmp, "loadsim.sqlite3")
+        if args.database:
+            copy_database(args.database, filename)
+        else:
+            import bench
+
+            db = Database(filename)
+            bench.generate(db, args.sales)
+            db.close()
+        for count in map(int, args.terminals.split(",")):
+            result = simulate(filename, count, args.duration, args.think, args.seed)
+            report(count, args.duration, *result)
+        Database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
+import os.path as _path
 import tkinter as _tk
 
 __all__ = ["create_image", "get_label"]
 
-_logo_default = "files/logo.png"
+_logo_default = _path.join(_path.dirname(_path.abspath(__file__)), "files", "logo.png")
 _logo = None
+_logo_file = None
 
 
 def create_image(filename=_logo_default):
-    global _logo
+    """decode the logo once per process, later calls reuse it"""
+    global _logo, _logo_file
+    if _logo is not None and _logo_file == filename:
+        return
     _logo = _tk.PhotoImage(file=filename)
+    _logo_file = filename
 
 
 def get_label(master):
@@ -1,23 +1,62 @@
 #!/usr/bin/env python3
+import time as _time
+
+_started = _time.perf_counter()
+
+import os as _os
 import sys
+import threading as _threading
 
-import cashier
 import logo
 import util
 import style
+import uiprofile
 import window
 from db_sqlite import Database
 from login import Login, Roles
 
+# milliseconds after startup before bonus codes are rotated,
+# so that the login window is drawn first
+_housekeeping_delay = 500
+
+# set to run sales through groupcommit, imported only then
+_group_commit_env_var = "COFFEE_GROUP_COMMIT"
+
+# (phase, seconds since the previous one) for --startup-profile
+_phases = []
+_last = [_started]
+
+
+def _phase(name):
+    now = _time.perf_counter()
+    _phases.append((name, now - _last[0]))
+    _last[0] = now
+
+
+_phase("imports")
+
 
 class MainWindow(window.RootWindow):
     def __init__(self):
         super().__init__("Cinnabon")
+        _phase("tk")
         logo.create_image()
+        _phase("logo")
         style.init_style()
+        _phase("style")
         self._db = Database()
-        self._db.generate_codes()
+        _phase("database")
+        self.after(_housekeeping_delay, self.start_housekeeping)
         self.create_widgets()
+        _phase("widgets")
+
+    def start_housekeeping(self):
+        _threading.Thread(target=self.generate_codes, daemon=True).start()
+
+    def generate_codes(self):
+        db = Database()
+        db.generate_codes()
+        db.close()
 
     def create_widgets(self):
         logo.get_label(self).pack()
@@ -45,17 +84,50 @@ class MainWindow(window.RootWindow):
             login_window.buttons[1].invoke()
 
     def open_window(self, role):
-        win = cashier.Cashier(role == Roles.ADMIN.value)
-        util.set_close_handler(win, lambda: self.close_handler(win))
+        # the windows and everything they need load on first login
+        import cashier
+
+        is_admin = role == Roles.ADMIN.value
+        windows = [cashier.Cashier(is_admin)]
+        if is_admin:
+            import admin
+
+            windows.append(admin.Admin())
+        for win in windows:
+            util.set_close_handler(win, lambda: self.close_handler(windows))
         self.withdraw()
 
-    def close_handler(self, win):
-        win.destroy()
+    def close_handler(self, windows):
+        # closing either window logs out
+        for win in windows:
+            win.destroy()
         self.deiconify()
 
 
+def print_startup_profile():
+    total = sum(seconds for _, seconds in _phases)
+    for name, seconds in _phases:
+        print("%-12s %8.1f ms" % (name, seconds * 1000))
+    print("%-12s %8.1f ms" % ("total", total * 1000))
+
+
 def run():
+    startup_profile = "--startup-profile" in sys.argv
+    if startup_profile:
+        sys.argv.remove("--startup-profile")
+    # before any widget, so that every callback gets timed
+    profiling = uiprofile.start_from_env()
+    if _os.environ.get(_group_commit_env_var):
+        import groupcommit
+
+        groupcommit.start_from_env()
     root = MainWindow()
+    if profiling:
+        uiprofile.watch(root)
+    if startup_profile:
+        root.update()
+        _phase("first paint")
+        print_startup_profile()
     root.mainloop()
 
 
@@ -0,0 +1,188 @@
+"""opt-in statistics of the statements Database runs: count, total and
+longest time and rows returned per statement, and a log of slow ones with
+their query plans. While disabled Database keeps its plain cursor, so
+nothing is measured and nothing is paid"""
+import collections as _collections
+import json as _json
+import os as _os
+import threading as _threading
+import time as _time
+
+__all__ = ["QueryStats", "TracedCursor", "current", "enable", "disable"]
+
+# seconds a statement may take before it is logged as slow
+_slow = 0.05
+_log_size = 100
+_args_length = 200
+
+# set to a threshold in milliseconds to collect statistics from startup
+_env_var = "COFFEE_QUERY_STATS"
+
+_stats = None
+
+
+class QueryStats:
+    """statistics shared by any number of connections and threads"""
+
+    def __init__(self, slow=_slow, log_size=_log_size):
+        self.slow = slow
+        self._lock = _threading.Lock()
+        # statement: [executions, total seconds, longest seconds, rows]
+        self._statements = {}
+        self._slow_log = _collections.deque(maxlen=log_size)
+
+    def add(self, sql, seconds, rows, longest, executed):
+        with self._lock:
+            entry = self._statements.get(sql)
+            if entry is None:
+                entry = self._statements[sql] = [0, 0.0, 0.0, 0]
+            entry[0] += executed
+            entry[1] += seconds
+            entry[3] += rows
+            if longest > entry[2]:
+                entry[2] = longest
+
+    def log_slow(self, sql, args, seconds, plan):
+        args = repr(args)
+        if len(args) > _args_length:
+            args = args[:_args_length] + "..."
+        with self._lock:
+            self._slow_log.append(
+                (_time.strftime("%Y-%m-%d %H:%M:%S"), seconds, sql, args, plan)
+            )
+
+    def statements(self):
+        """(statement, executions, total, longest, rows), slowest total first"""
+        with self._lock:
+            rows = [(sql, *entry) for sql, entry in self._statements.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def slow_log(self):
+        """(time, seconds, statement, arguments, plan lines), newest last"""
+        with self._lock:
+            return list(self._slow_log)
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow_log.clear()
+
+    def to_dict(self):
+        return {
+            "slow": self.slow,
+            "statements": [
+                dict(zip(["sql", "count", "total", "max", "rows"], row))
+                for row in self.statements()
+            ],
+            "slow_log": [
+                dict(zip(["time", "seconds", "sql", "args", "plan"], row))
+                for row in self.slow_log()
+            ],
+        }
+
+    def dump(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            _json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+class TracedCursor:
+    """a sqlite3 cursor that times every statement and counts the rows
+    fetched from it; the time of an execution includes its fetches"""
+
+    __slots__ = ("_cursor", "_stats", "_sql", "_args", "_elapsed", "_logged")
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._sql = None
+        self._args = None
+        self._elapsed = 0.0
+        self._logged = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _record(self, seconds, rows, executed=0):
+        self._elapsed += seconds
+        self._stats.add(self._sql, seconds, rows, self._elapsed, executed)
+        if self._elapsed >= self._stats.slow and not self._logged:
+            self._logged = True
+            self._stats.log_slow(self._sql, self._args, self._elapsed, self._plan())
+
+    def _plan(self):
+        if self._args is None:
+            return None
+        try:
+            cur = self._cursor.connection.execute(
+                "EXPLAIN QUERY PLAN " + self._sql, self._args
+            )
+            return [row[-1] for row in cur.fetchall()]
+        except Exception as e:  # statements like PRAGMA have no plan
+            return ["%s: %s" % (type(e).__name__, e)]
+
+    def _start(self, sql, args):
+        self._sql, self._args = sql, args
+        self._elapsed = 0.0
+        self._logged = False
+
+    def execute(self, sql, args=()):
+        self._start(sql, args)
+        start = _time.perf_counter()
+        self._cursor.execute(sql, args)
+        self._record(_time.perf_counter() - start, 0, 1)
+        return self
+
+    def executemany(self, sql, seq):
+        # the plan needs arguments, which a generator gives away only once
+        seq = seq if isinstance(seq, (list, tuple)) else list(seq)
+        self._start(sql, seq[0] if seq else None)
+        start = _time.perf_counter()
+        self._cursor.executemany(sql, seq)
+        self._record(_time.perf_counter() - start, 0, 1)
+        return self
+
+    def fetchone(self):
+        start = _time.perf_counter()
+        row = self._cursor.fetchone()
+        self._record(_time.perf_counter() - start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = _time.perf_counter()
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        self._record(_time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = _time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._record(_time.perf_counter() - start, len(rows))
+        return rows
+
+
+def current():
+    """the statistics being collected, None while disabled"""
+    return _stats
+
+
+def enable(slow=_slow):
+    """start collecting, into the running statistics if there are any;
+    Database objects pick the change up on their next statement"""
+    global _stats
+    if _stats is None:
+        _stats = QueryStats(slow)
+    else:
+        _stats.slow = slow
+    return _stats
+
+
+def disable():
+    global _stats
+    _stats = None
+
+
+if _os.environ.get(_env_var):
+    enable(float(_os.environ[_env_var]) / 1000)
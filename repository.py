@@ -0,0 +1,126 @@
+"""typed rows of goods, sales and clients, read through one registry of
+named statements; the statements are fixed strings, so every execution after
+the first is served from the sqlite3 statement cache of the connection.
+Entries are added as readers move over, not for every table up front"""
+
+__all__ = ["STATEMENTS", "Product", "Sale", "Client", "Repository"]
+
+_goods_columns = (
+    "id, name, manufacturer, amount, sell_price, use_by, purchase_price, bonuses, "
+    "returnable"
+)
+_sales_columns = "id, check_id, product_id, amount, sell_date, price"
+_clients_columns = "id, phone, name, bonuses, bonus_code, code_date"
+
+# name: statement, the only place the row statements are spelled out
+STATEMENTS = {
+    "goods": "SELECT %s FROM goods ORDER BY id" % _goods_columns,
+    "sales": "SELECT %s FROM sales ORDER BY id" % _sales_columns,
+    "client_by_code": "SELECT %s FROM clients WHERE bonus_code = ?"
+    % _clients_columns,
+}
+
+
+class Product:
+    """one row of the goods table"""
+
+    __slots__ = (
+        "id",
+        "name",
+        "manufacturer",
+        "amount",
+        "sell_price",
+        "use_by",
+        "purchase_price",
+        "bonuses",
+        "returnable",
+    )
+
+    def __init__(self, row):
+        (
+            self.id,
+            self.name,
+            self.manufacturer,
+            self.amount,
+            self.sell_price,
+            self.use_by,
+            self.purchase_price,
+            self.bonuses,
+            self.returnable,
+        ) = row
+
+    def row(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class Sale:
+    """one row of the sales table, price being the one it was sold at"""
+
+    __slots__ = ("id", "check_id", "product_id", "amount", "sell_date", "price")
+
+    def __init__(self, row):
+        (
+            self.id,
+            self.check_id,
+            self.product_id,
+            self.amount,
+            self.sell_date,
+            self.price,
+        ) = row
+
+    @property
+    def cost(self):
+        return self.amount * self.price
+
+    def row(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class Client:
+    """one row of the clients table"""
+
+    __slots__ = ("id", "phone", "name", "bonuses", "bonus_code", "code_date")
+
+    def __init__(self, row):
+        (
+            self.id,
+            self.phone,
+            self.name,
+            self.bonuses,
+            self.bonus_code,
+            self.code_date,
+        ) = row
+
+    def row(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class Repository:
+    """typed reads over a Database; use one per thread, like Database"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _all(self, type_, name, *args):
+        return list(map(type_, self.db.execute(STATEMENTS[name], args).fetchall()))
+
+    def _one(self, type_, name, *args):
+        row = self.db.execute(STATEMENTS[name], args).fetchone()
+        return None if row is None else type_(row)
+
+    def goods(self):
+        return self._all(Product, "goods")
+
+    def goods_changes(self, since):
+        """(id, Product) pairs of the goods changed after change number since,
+        None in place of deleted goods; see Database.get_changes"""
+        changes = self.db.get_changes("goods", since, _goods_columns)
+        if changes is None:
+            return None
+        return [(id_, row and Product(row)) for id_, row in changes]
+
+    def sales(self):
+        return self._all(Sale, "sales")
+
+    def client_by_code(self, code):
+        return self._one(Client, "client_by_code", code)
@@ -1,20 +1,28 @@
+import functools as _ft
 import json as _json
+import os.path as _path
 import tkinter as _tk
 import tkinter.ttk as _ttk
 
 __all__ = ["init_style", "lookup"]
 
-_default_name = "files/style.json"
+_default_name = _path.join(
+    _path.dirname(_path.abspath(__file__)), "files", "style.json"
+)
 _style = None
 
 
+@_ft.lru_cache(maxsize=None)
+def _load(filename):
+    with open(filename) as f:
+        return _json.load(f)
+
+
 def init_style(filename=_default_name):
     global _style
     _style = _ttk.Style()
 
-    with open(filename) as f:
-        data = _json.load(f)
-    for k, v in data.items():
+    for k, v in _load(filename).items():
         _style.configure(k, **v)
 
 
@@ -1,12 +1,29 @@
+import functools as _ft
 import tkinter.ttk as _ttk
 
+import util
+
 
 class TableView(_ttk.Treeview):
-    def __init__(self, master=None, db=None, table=None, columns=None, on_select=None):
+    def __init__(
+        self,
+        master=None,
+        db=None,
+        table=None,
+        columns=None,
+        on_select=None,
+        worker=None,
+        formats=None,
+    ):
         super().__init__(master)
 
         self.db = db
         self.table = table
+        self.worker = worker
+        self._seq = None
+        # row index: function making the shown text of the value there,
+        # such as dates.from_day for day numbers
+        self._formats = formats or {}
 
         self.config(columns=columns)
 
@@ -21,21 +38,244 @@ class TableView(_ttk.Treeview):
 
     def clear(self):
         self.delete(*self.get_children())
+        self._seq = None
 
     def clear_selection(self):
         self.selection_remove(self.selection())
 
     def update_data(self):
+        """apply the rows changed since the last refresh; rows are keyed by
+        their primary key, so selection and scroll position survive"""
         if not self.db or not self.table:
             return
+        if self.worker is None:
+            self.apply_changes(self.fetch_changes(self.db, self._seq))
+        else:
+            self.worker.submit(
+                self.fetch_changes, self._seq, on_done=self.apply_changes
+            )
+
+    def fetch_changes(self, db, since):
+        """safe to run on a worker thread: returns the current change number,
+        the rows changed after since and, if the change log does not reach
+        back that far, the rows for a full reload"""
+        seq = db.get_change_seq()
+        changes = None if since is None else db.get_changes(self.table, since)
+        rows = self.fetch_rows(db) if changes is None else None
+        return seq, changes, rows
+
+    def fetch_rows(self, db):
+        return db.get_table(self.table)
+
+    def values(self, row):
+        formats = self._formats
+        if not formats:
+            return [str(x) for x in row]
+        return [formats[i](x) if i in formats else str(x) for i, x in enumerate(row)]
+
+    def apply_changes(self, result):
+        seq, changes, rows = result
+        if changes is None:
+            self.reload(rows)
+        else:
+            for id_, row in changes:
+                self.set_row(str(id_), row)
+        self._seq = seq
 
+    def reload(self, rows=None):
+        if rows is None:
+            rows = self.fetch_rows(self.db)
+        selection = self.selection()
+        yview = self.yview()[0]
         self.clear()
+        for row in rows:
+            self.insert("", "end", iid=str(row[0]), values=self.values(row))
+        self.selection_set([iid for iid in selection if self.exists(iid)])
+        self.yview_moveto(yview)
 
-        for row in self.db.get_table(self.table):
-            row = tuple(str(x) for x in row)
-            self.insert("", "end", values=row)
+    def set_row(self, iid, row):
+        if row is None:
+            if self.exists(iid):
+                self.delete(iid)
+        elif self.exists(iid):
+            self.item(iid, values=self.values(row))
+        else:
+            self.insert("", "end", iid=iid, values=self.values(row))
 
     def on_select(self, event, func):
         if func is None:
             return
         func(event, self.item(self.focus()))
+
+
+class PagedTableView(TableView):
+    """keeps at most pages * page_size rows of a large table in the widget,
+    fetching pages by key on the worker as the user scrolls; the headings of
+    the key and of indexed columns sort in the database"""
+
+    def __init__(
+        self,
+        master=None,
+        db=None,
+        table=None,
+        columns=None,
+        on_select=None,
+        worker=None,
+        formats=None,
+        page_size=200,
+        pages=3,
+    ):
+        super().__init__(master, db, table, columns, on_select, worker, formats)
+        self._page_size = page_size
+        self._pages = pages
+        self._order = None
+        self._desc = False
+        self._keys = {}
+        self._at_start = self._at_end = True
+        self._loading = False
+        # a page is being fetched on the worker
+        self._fetching = False
+        # bumped on every reload, pages fetched before it are dropped
+        self._generation = 0
+
+        self._order_index = None
+        self._db_columns = db.get_columns(table)
+        # any other order sorts the whole table for every page
+        sortable = {self._db_columns[0]} | db.get_indexed_columns(table)
+        for c, name in zip(columns, self._db_columns):
+            if name in sortable:
+                self.heading(c, command=_ft.partial(self.sort_by, name))
+        self.config(yscrollcommand=self.on_scroll)
+
+    def clear(self):
+        super().clear()
+        self._keys.clear()
+        self._generation += 1
+        self._fetching = False
+
+    def sort_by(self, column):
+        if column == self._db_columns[0]:
+            column = None
+        self._desc = not self._desc if column == self._order else False
+        self._order = column
+        self._order_index = None if column is None else self._db_columns.index(column)
+        if self.worker is None:
+            self.reload()
+        else:
+            self.worker.submit(self.fetch_rows, on_done=self.reload)
+
+    def _key(self, row):
+        if self._order is None:
+            return row[0]
+        return (row[self._order_index], row[0])
+
+    def _page(self, db=None, **kwargs):
+        return (db or self.db).get_page(
+            self.table, self._order, limit=self._page_size, desc=self._desc, **kwargs
+        )
+
+    def fetch_rows(self, db):
+        return self._page(db)
+
+    def _insert(self, index, row):
+        iid = str(row[0])
+        self._keys[iid] = self._key(row)
+        self.insert("", index, iid=iid, values=self.values(row))
+
+    def _trim(self, children):
+        for iid in children:
+            self._keys.pop(iid, None)
+        self.delete(*children)
+
+    def reload(self, rows=None):
+        if rows is None:
+            rows = self._page()
+        selection = self.selection()
+        self.clear()
+        for row in rows:
+            self._insert("end", row)
+        self._at_start = True
+        self._at_end = len(rows) < self._page_size
+        self.selection_set([iid for iid in selection if self.exists(iid)])
+
+    def _fetch(self, on_done, **kwargs):
+        """fetch a page on the worker, if any, and hand it to on_done"""
+        if self.worker is None:
+            return on_done(self._page(**kwargs))
+        self._fetching = True
+        generation = self._generation
+
+        def done(rows):
+            if generation == self._generation:
+                self._fetching = False
+                on_done(rows)
+
+        self.worker.submit(
+            _ft.partial(self._page, **kwargs), on_done=done, on_error=self._failed
+        )
+
+    def _failed(self, error):
+        self._fetching = False
+        util.show_error("Ошибка базы данных: %s" % error)
+
+    def load_next(self):
+        children = self.get_children()
+        if self._at_end or self._fetching or not children:
+            return
+        self._fetch(self._show_next, after=self._keys[children[-1]])
+
+    def _show_next(self, rows):
+        children = self.get_children()
+        for row in rows:
+            self._insert("end", row)
+        self._at_end = len(rows) < self._page_size
+
+        excess = len(children) + len(rows) - self._pages * self._page_size
+        if excess > 0:
+            self._trim(children[:excess])
+            self._at_start = False
+        if children and self.exists(children[-1]):
+            self.see(children[-1])
+
+    def load_previous(self):
+        children = self.get_children()
+        if self._at_start or self._fetching or not children:
+            return
+        self._fetch(self._show_previous, before=self._keys[children[0]])
+
+    def _show_previous(self, rows):
+        children = self.get_children()
+        for i, row in enumerate(rows):
+            self._insert(i, row)
+        self._at_start = len(rows) < self._page_size
+
+        excess = len(children) + len(rows) - self._pages * self._page_size
+        if excess > 0:
+            self._trim(children[-excess:])
+            self._at_end = False
+        if children and self.exists(children[0]):
+            self.see(children[0])
+
+    def on_scroll(self, first, last):
+        if self._loading:
+            return
+        self._loading = True
+        try:
+            if float(last) >= 1.0 and not self._at_end:
+                self.load_next()
+            elif float(first) <= 0.0 and not self._at_start:
+                self.load_previous()
+        finally:
+            self._loading = False
+
+    def set_row(self, iid, row):
+        if row is None:
+            self._keys.pop(iid, None)
+        elif self.exists(iid):
+            self._keys[iid] = self._key(row)
+        elif self._at_end and self._order is None and not self._desc:
+            # new rows only belong to the window when it shows the tail
+            self._keys[iid] = self._key(row)
+        else:
+            return
+        super().set_row(iid, row)
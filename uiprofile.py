@@ -0,0 +1,207 @@
+"""timing of Tk callbacks: every command, event binding and after() callback
+is timed by handler, main loop stalls are caught by a heartbeat, and on exit
+a histogram per handler is written, optionally with a cProfile dump or
+sampled stacks in the collapsed format of flame graph tools.
+
+Enabled by COFFEE_UI_PROFILE set to "hist", "cprofile" or "stacks";
+files go to COFFEE_UI_PROFILE_DIR, the current directory by default"""
+import atexit as _atexit
+import functools as _ft
+import os as _os
+import os.path as _path
+import sys
+import threading as _threading
+import time as _time
+import tkinter as _tk
+
+__all__ = ["MODES", "start", "start_from_env", "watch", "report"]
+
+MODES = ["hist", "cprofile", "stacks"]
+
+_env_var = "COFFEE_UI_PROFILE"
+_dir_env_var = "COFFEE_UI_PROFILE_DIR"
+
+# upper bounds of the histogram buckets, milliseconds
+_buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+_heartbeat_ms = 50
+# lateness of the heartbeat counted as a stall, milliseconds
+_stall_ms = 100
+_sample_interval = 0.002
+
+_stall_name = "<main loop stall>"
+# handlers left out of the report
+_internal = ("watch.<locals>.heartbeat",)
+
+_handlers = {}
+_depth = 0
+_profile = None
+_stacks = None
+_started = None
+
+
+class _Handler:
+    """calls, total and longest time and the histogram of one handler"""
+
+    __slots__ = ("calls", "total", "longest", "counts")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.counts = [0] * (len(_buckets) + 1)
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.longest:
+            self.longest = seconds
+        ms = seconds * 1000
+        for i, bound in enumerate(_buckets):
+            if ms <= bound:
+                break
+        else:
+            i = len(_buckets)
+        self.counts[i] += 1
+
+
+def _record(name, seconds):
+    handler = _handlers.get(name)
+    if handler is None:
+        handler = _handlers[name] = _Handler()
+    handler.add(seconds)
+
+
+def _name(func):
+    """Cashier.on_sell and the like, lambdas with their place in the source"""
+    while isinstance(func, _ft.partial):
+        func = func.func
+    code = getattr(func, "__code__", None)
+    if code is not None and code.co_name == "callit" and func.__closure__:
+        # after() wraps the callback into a closure of its own
+        cells = dict(zip(code.co_freevars, func.__closure__))
+        if "func" in cells:
+            return _name(cells["func"].cell_contents)
+    name = getattr(func, "__qualname__", None) or repr(func)
+    if "<lambda>" in name and code is not None:
+        name += " %s:%d" % (_path.basename(code.co_filename), code.co_firstlineno)
+    return name
+
+
+class _TimedCallWrapper(_tk.CallWrapper):
+    def __init__(self, func, subst, widget):
+        super().__init__(func, subst, widget)
+        self.name = _name(func)
+
+    def __call__(self, *args):
+        global _depth
+        if _depth == 0 and _profile is not None:
+            _profile.enable()
+        _depth += 1
+        start = _time.perf_counter()
+        try:
+            return super().__call__(*args)
+        finally:
+            _depth -= 1
+            if _depth == 0 and _profile is not None:
+                _profile.disable()
+            _record(self.name, _time.perf_counter() - start)
+
+
+def _sample(main_id):
+    # collapsed stacks of the main thread while it runs a handler
+    while True:
+        _time.sleep(_sample_interval)
+        if not _depth:
+            continue
+        frame = sys._current_frames().get(main_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                "%s:%s" % (_path.basename(code.co_filename), code.co_qualname)
+            )
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        _stacks[key] = _stacks.get(key, 0) + 1
+
+
+def start(mode="hist"):
+    """time every Tk callback registered from now on;
+    mode is one of MODES, see the module docstring"""
+    global _profile, _stacks, _started
+    if _started is not None:
+        return
+    if mode not in MODES:
+        raise ValueError("unknown profiling mode %s" % mode)
+    _started = mode
+    _tk.CallWrapper = _TimedCallWrapper
+    if mode == "cprofile":
+        import cProfile
+
+        _profile = cProfile.Profile()
+    elif mode == "stacks":
+        _stacks = {}
+        _threading.Thread(
+            target=_sample, args=(_threading.get_ident(),), daemon=True
+        ).start()
+    _atexit.register(report)
+
+
+def start_from_env():
+    """start() in the mode given by the environment, if any;
+    returns whether profiling is on"""
+    mode = _os.environ.get(_env_var)
+    if mode:
+        start(mode)
+    return _started is not None
+
+
+def watch(widget, interval=_heartbeat_ms):
+    """schedule a heartbeat on the main loop of widget; every time it comes
+    more than _stall_ms late, the delay counts as a stall"""
+    expected = [_time.perf_counter() + interval / 1000]
+
+    def heartbeat():
+        now = _time.perf_counter()
+        late = now - expected[0]
+        if late * 1000 > _stall_ms:
+            _record(_stall_name, late)
+        expected[0] = now + interval / 1000
+        widget.after(interval, heartbeat)
+
+    widget.after(interval, heartbeat)
+
+
+def _histogram_lines():
+    header = "%-60s %7s %10s %9s" % ("handler", "calls", "total ms", "max ms")
+    header += "".join(" %6s" % ("<=%d" % b) for b in _buckets)
+    header += " %6s" % (">%d" % _buckets[-1])
+    lines = [header]
+    handlers = sorted(_handlers.items(), key=lambda item: -item[1].total)
+    for name, h in handlers:
+        if name in _internal:
+            continue
+        line = "%-60s %7d %10.1f %9.1f" % (
+            name[:60],
+            h.calls,
+            h.total * 1000,
+            h.longest * 1000,
+        )
+        lines.append(line + "".join(" %6d" % n for n in h.counts))
+    return lines
+
+
+def report(directory=None):
+    """write the histogram and the profile of the selected mode"""
+    if _started is None:
+        return
+    directory = directory or _os.environ.get(_dir_env_var) or _os.getcwd()
+    base = _path.join(directory, "uiprofile-%d" % _os.getpid())
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(_histogram_lines()) + "\n")
+    if _profile is not None:
+        _profile.dump_stats(base + ".prof")
+    if _stacks is not None:
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in sorted(_stacks.items()):
+                f.write("%s %d\n" % (stack, count))
@@ -0,0 +1,94 @@
+import queue as _queue
+import sys
+import threading as _threading
+
+import db_sqlite
+import util
+from db_sqlite import Database
+
+__all__ = ["Worker"]
+
+# milliseconds between checks for finished jobs while any are in flight
+_poll_interval = 10
+
+
+def _show_error(error):
+    util.show_error("Ошибка базы данных: %s" % error)
+
+
+class Worker:
+    """runs database jobs in order on a thread with its own connection;
+    results are handed back on the Tk thread of widget through after() polling"""
+
+    def __init__(self, widget, filename=None):
+        self._widget = widget
+        self._jobs = _queue.Queue()
+        self._results = _queue.Queue()
+        self._pending = 0
+        self._poll_id = None
+        self.on_busy = None
+
+        args = () if filename is None else (filename,)
+        self._thread = _threading.Thread(target=self._run, args=args, daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def submit(self, func, *args, on_done=None, on_error=_show_error):
+        """run func(db, *args) on the worker, then on_done(result)
+        or on_error(exception) on the Tk thread"""
+        self._jobs.put((func, args, on_done, on_error))
+        self._pending += 1
+        if self._pending == 1:
+            self._set_busy(True)
+        if self._poll_id is None:
+            self._poll_id = self._widget.after(_poll_interval, self._poll)
+
+    def stop(self):
+        if self._poll_id is not None:
+            self._widget.after_cancel(self._poll_id)
+            self._poll_id = None
+        self._jobs.put(None)
+
+    def _run(self, *db_args):
+        db = Database(*db_args)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            func, args, on_done, on_error = job
+            try:
+                self._results.put((on_done, func(db, *args)))
+            except Exception as e:
+                if db._connection.in_transaction:
+                    db._connection.rollback()
+                self._results.put((on_error, e))
+        db.close()
+        # stop() ends the thread, so its connection goes with it
+        db_sqlite.disconnect(*db_args)
+
+    def _poll(self):
+        self._poll_id = None
+        while True:
+            try:
+                callback, result = self._results.get_nowait()
+            except _queue.Empty:
+                break
+            self._pending -= 1
+            if callback is None:
+                continue
+            try:
+                callback(result)
+            except Exception:
+                # reported like any Tk callback, the other results still go out
+                self._widget._root().report_callback_exception(*sys.exc_info())
+        if not self._pending:
+            self._set_busy(False)
+        elif self._poll_id is None:
+            self._poll_id = self._widget.after(_poll_interval, self._poll)
+
+    def _set_busy(self, busy):
+        if self.on_busy is not None:
+            self.on_busy(busy)